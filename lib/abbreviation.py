@@ -1,4 +1,5 @@
 import re
+import json
 import html
 import traceback
 import sublime
@@ -6,11 +7,13 @@ from ..emmet import Abbreviation as MarkupAbbreviation, markup_abbreviation, sty
 from ..emmet.config import Config
 from ..emmet.stylesheet import CSSAbbreviationScope
 from .emmet_sublime import get_jsx_prefix, expand, extract_abbreviation
-from .utils import pairs, pairs_end, known_tags, replace_with_snippet
+from .utils import pairs, pairs_end, replace_with_snippet
+from .candidates import get_classifier, is_complex, is_word
 from .context import get_activation_context
 from .config import get_preview_config, get_settings, get_user_css
 from . import syntax
 from . import html_highlight
+from . import view_state
 
 ABBR_REGION_ID = 'emmet-abbreviation'
 ABBR_PREVIEW_ID = 'emmet-abbreviation-preview'
@@ -21,15 +24,6 @@ re_stylesheet_word_bound = re.compile(r'^[\s;"\'(){}]?[a-zA-Z!@]$')
 re_stylesheet_preview_check = re.compile(r'/^:\s*;?$/')
 re_word_start = re.compile(r'^[a-z]', re.IGNORECASE)
 re_bound_char = re.compile(r'^[\s>;"\']')
-re_complex_abbr = re.compile(r'[.#>^+*\[\(\{\/]')
-re_lorem = re.compile(r'^lorem')
-
-_cache = {}
-_trackers = {}
-_last_pos = {}
-_forced_indicator = {}
-_phantom_preview = {}
-_has_popup_preview = {}
 
 
 class AbbreviationTracker:
@@ -92,17 +86,19 @@ class AbbreviationTrackerError(AbbreviationTracker):
 
 def get_last_pos(editor: sublime.View) -> int:
     "Returns last known location of caret in given editor"
-    return _last_pos.get(editor.id())
+    state = view_state.get_view(editor)
+    return state.last_pos if state else None
 
 
 def set_last_pos(editor: sublime.View, pos: int):
     "Sets last known caret location for given editor"
-    _last_pos[editor.id()] = pos
+    view_state.get_view(editor, True).last_pos = pos
 
 
 def get_tracker(editor: sublime.View) -> AbbreviationTracker:
     "Returns abbreviation tracker for given editor, if any"
-    return _trackers.get(editor.id())
+    state = view_state.get_view(editor)
+    return state.tracker if state else None
 
 def typing_abbreviation(editor: sublime.View, pos: int) -> AbbreviationTracker:
     "Detects if user is typing abbreviation at given location"
@@ -217,7 +213,7 @@ def stop_tracking(editor: sublime.View, params: dict = {}):
 def set_active_tracker(editor: sublime.View, tracker: AbbreviationTracker) -> AbbreviationTracker:
     "Sets currently active tracker"
     _dispose_tracker(editor)
-    _trackers[editor.id()] = tracker
+    view_state.get_view(editor, True).tracker = tracker
     mark(editor, tracker)
     return tracker
 
@@ -254,6 +250,14 @@ def create_tracker(editor: sublime.View, region: sublime.Region, params: dict) -
         'last_pos': region.end(),
     }
 
+    if not forced and is_word(abbreviation) and not is_candidate_prefix(abbreviation, config):
+        # Single word which is neither known tag or snippet nor a beginning
+        # of it: it won’t be marked or expanded with Tab, no need to parse it.
+        # Any other text is parsed to report invalid abbreviations
+        tracker_params['simple'] = True
+        tracker_params['preview'] = ''
+        return AbbreviationTrackerValid(abbreviation, region, config, tracker_params)
+
     try:
         tracker_params['simple'] = False
 
@@ -288,12 +292,13 @@ def create_tracker(editor: sublime.View, region: sublime.Region, params: dict) -
 
 def store_tracker(editor: sublime.View, tracker: AbbreviationTracker):
     "Stores given tracker in separate cache to restore later"
-    _cache[editor.id()] = tracker
+    view_state.get_view(editor, True).stored_tracker = tracker
 
 
 def get_stored_tracker(editor: sublime.View) -> AbbreviationTracker:
     "Returns stored tracker for given editor proxy, if any"
-    return _cache.get(editor.id())
+    state = view_state.get_view(editor)
+    return state.stored_tracker if state else None
 
 
 def restore_tracker(editor: sublime.View, pos: int) -> AbbreviationTracker:
@@ -402,26 +407,22 @@ def handle_selection_change(editor: sublime.View, pos: int) -> AbbreviationTrack
 def dispose_editor(editor: sublime.View):
     """
     Method should be called when given editor instance will be no longer
-    available to clean up cached data
+    available to clean up abbreviation markers. Cached data is removed
+    with view state in `view_state.dispose()`
     """
     stop_tracking(editor)
-    _dispose_cache_tracker(editor)
-    _dispose_tracker(editor)
-    remove_cache_item(editor, _last_pos)
 
 
 def _dispose_tracker(editor: sublime.View):
-    remove_cache_item(editor, _trackers)
+    state = view_state.get_view(editor)
+    if state:
+        state.tracker = None
 
 
 def _dispose_cache_tracker(editor: sublime.View):
-    remove_cache_item(editor, _cache)
-
-
-def remove_cache_item(editor: sublime.View, cache: dict):
-    e_id = editor.id()
-    if e_id in cache:
-        del cache[e_id]
+    state = view_state.get_view(editor)
+    if state:
+        state.stored_tracker = None
 
 
 def get_by_key(obj, key, default_value=None):
@@ -543,10 +544,10 @@ def mark(editor: sublime.View, tracker: AbbreviationTracker):
             sublime.Phantom(tracker.region, forced_indicator('⋮>'), sublime.LAYOUT_INLINE)
         ]
 
-        key = editor.id()
-        if key not in _forced_indicator:
-            _forced_indicator[key] = sublime.PhantomSet(editor, ABBR_REGION_ID)
-        _forced_indicator[key].update(phantoms)
+        state = view_state.get_view(editor, True)
+        if state.forced_indicator is None:
+            state.forced_indicator = sublime.PhantomSet(editor, ABBR_REGION_ID)
+        state.forced_indicator.update(phantoms)
 
 
 def unmark(editor: sublime.View):
@@ -567,7 +568,6 @@ def show_preview(editor: sublime.View, tracker: AbbreviationTracker):
     if not is_preview_enabled(tracker):
         return
 
-    key = editor.id()
     content = None
     as_phantom = tracker.config.type == 'stylesheet'
 
@@ -596,11 +596,12 @@ def show_preview(editor: sublime.View, tracker: AbbreviationTracker):
         r = sublime.Region(pos, pos)
         phantoms = [sublime.Phantom(r, preview_phantom_html(content), sublime.LAYOUT_INLINE)]
 
-        if key not in _phantom_preview:
-            _phantom_preview[key] = sublime.PhantomSet(editor, ABBR_PREVIEW_ID)
-        _phantom_preview[key].update(phantoms)
+        state = view_state.get_view(editor, True)
+        if state.phantom_preview is None:
+            state.phantom_preview = sublime.PhantomSet(editor, ABBR_PREVIEW_ID)
+        state.phantom_preview.update(phantoms)
     else:
-        _has_popup_preview[key] = True
+        view_state.get_view(editor, True).has_popup_preview = True
         editor.show_popup(
             preview_popup_html(content),
             flags=sublime.COOPERATE_WITH_AUTO_COMPLETE,
@@ -610,13 +611,15 @@ def show_preview(editor: sublime.View, tracker: AbbreviationTracker):
 
 def hide_preview(editor: sublime.View):
     "Hides preview of current abbreviation in given view"
-    key = editor.id()
-    if _has_popup_preview.get(key):
+    state = view_state.get_view(editor)
+    if state is None:
+        return
+    if state.has_popup_preview:
         editor.hide_popup()
-        del _has_popup_preview[key]
-    if _phantom_preview.get(key):
+        state.has_popup_preview = False
+    if state.phantom_preview:
         editor.erase_phantoms(ABBR_PREVIEW_ID)
-        del _phantom_preview[key]
+        state.phantom_preview = None
 
 
 def preview_popup_html(content: str):
@@ -707,21 +710,108 @@ def expand_tracker(editor: sublime.View, edit: sublime.Edit, tracker: Abbreviati
         replace_with_snippet(editor, edit, tracker.region, snippet)
 
 
+def get_expansion(editor: sublime.View, pos: int, snippets: dict, tracker: AbbreviationTracker = None) -> tuple:
+    """
+    Returns `(region, snippet, config)` for abbreviation which can be expanded
+    at given location, if any. If `tracker` contains given location, its
+    abbreviation is used. Otherwise, abbreviation is extracted without creating
+    tracker. Expanded snippets are shared via `snippets` dict between abbreviations
+    with the same contents and context, so the same abbreviation at multiple
+    locations is expanded once
+    """
+    if tracker and tracker.region.contains(pos):
+        if isinstance(tracker, AbbreviationTrackerValid):
+            snippet = get_snippet(tracker.abbreviation, tracker.config, snippets)
+            if snippet is not None:
+                return tracker.region, snippet, tracker.config
+        return None
+
+    if not allow_tracking(editor, pos):
+        return None
+
+    config = get_activation_context(editor, pos)
+    if config:
+        abbr = extract_abbreviation(editor, pos, config)
+        if abbr and abbr.abbreviation:
+            snippet = get_snippet(abbr.abbreviation, config, snippets)
+            if snippet is not None:
+                return sublime.Region(abbr.start, abbr.end), snippet, config
+
+    return None
+
+
+def get_completion(editor: sublime.View, pos: int) -> tuple:
+    """
+    Returns `(label, snippet)` for valid abbreviation candidate at given location,
+    if any. Abbreviation is taken from active tracker or extracted from editor,
+    but tracker is neither created nor updated, so it’s safe to call it
+    from async thread
+    """
+    tracker = get_tracker(editor)
+    if tracker and tracker.region.contains(pos):
+        if not isinstance(tracker, AbbreviationTrackerValid) or not tracker.valid_candidate:
+            return None
+        label = editor.substr(tracker.region)
+        abbr = tracker.abbreviation
+        config = tracker.config
+    else:
+        if not allow_tracking(editor, pos):
+            return None
+
+        config = get_activation_context(editor, pos)
+        abbr_data = extract_abbreviation(editor, pos, config) if config else None
+        if not abbr_data or not abbr_data.abbreviation or \
+            not is_valid_candidate(abbr_data.abbreviation, config):
+            return None
+        label = editor.substr(sublime.Region(abbr_data.start, abbr_data.end))
+        abbr = abbr_data.abbreviation
+
+    snippet = get_snippet(abbr, config, {})
+    return (label, snippet) if snippet is not None else None
+
+
+def get_snippet(abbr: str, config: Config, snippets: dict) -> str:
+    "Returns expanded snippet for given abbreviation, shared between the same contexts"
+    key = (abbr, config.type, config.syntax, json.dumps(config.context, sort_keys=True))
+    if key not in snippets:
+        try:
+            snippet = expand(abbr, config)
+        except:
+            snippet = None
+
+        if config.type == 'stylesheet' and not snippet:
+            # Empty output means Emmet was unable to find proper match for
+            # stylesheet abbreviation, like tracker does
+            snippet = None
+
+        snippets[key] = snippet
+
+    return snippets[key]
+
+
 def is_valid_candidate(abbr: str, config: Config) -> bool:
     "Check if given string is a valid candidate for Emmet abbreviation"
-    if re_complex_abbr.search(abbr):
+    if is_complex(abbr):
         return True
 
-    # Looks like a single-word abbreviation, check if it’s a valid candidate:
-    # * contains dash (web components)
-    # * upper-cased (JSX, Svelte components)
-    # * known HTML tags
-    # * known Emmet snippets
-    if config.type == 'markup' and config.syntax in get_settings('known_snippets_only', []):
-        return '-' in abbr \
-            or (abbr and abbr[0].isupper()) \
-            or abbr in known_tags \
-            or abbr in config.snippets \
-            or re_lorem.match(abbr)
+    # Looks like a single-word abbreviation, check if it’s a valid candidate
+    if known_snippets_only(config):
+        return get_classifier(config).is_candidate(abbr)
+
+    return True
+
+
+def is_candidate_prefix(abbr: str, config: Config) -> bool:
+    """
+    Check if given string is a valid candidate for Emmet abbreviation or
+    may become one if user continues typing it
+    """
+    if known_snippets_only(config) and not is_complex(abbr):
+        return get_classifier(config).is_candidate_prefix(abbr)
 
     return True
+
+
+def known_snippets_only(config: Config) -> bool:
+    "Check if single-word abbreviations are limited to known snippets for given config"
+    return config.type == 'markup' and config.syntax in get_settings('known_snippets_only', [])
@@ -2,6 +2,9 @@ import sublime
 from . import emmet_sublime as emmet
 from . import syntax
 from .utils import get_content, to_region
+from . import view_state
+
+max_cached_chains = 64
 
 
 def push_range(items, region):
@@ -11,7 +14,46 @@ def push_range(items, region):
 
 
 def get_regions(view: sublime.View, pt: int, syntax_name: str, direction='outward'):
-    "Returns regions for balancing"
+    """
+    Returns regions for balancing. Regions are cached for current buffer
+    revision so that repeated balancing walks the same list
+    """
+    chains = get_chains(view, syntax_name, direction)
+    regions = chains.get(pt)
+    if regions is None:
+        if len(chains) >= max_cached_chains:
+            chains.clear()
+        regions = chains[pt] = compute_regions(view, pt, syntax_name, direction)
+    return regions
+
+
+def get_chains(view: sublime.View, syntax_name: str, direction: str) -> dict:
+    """
+    Returns cached balancing regions for current buffer revision, keyed
+    by location or by `(begin, end)` of balanced region
+    """
+    state = view_state.get_buffer(view, True)
+    key = (view.change_count(), syntax_name, direction)
+    if state.balance_key != key:
+        state.balance_key = key
+        state.balance_chains = {}
+    return state.balance_chains
+
+
+def remember_regions(view: sublime.View, region: sublime.Region, syntax_name: str,
+                     direction: str, regions: list):
+    """
+    Stores balancing regions for given balanced region, so that the next
+    balancing of exactly this selection reuses them
+    """
+    chains = get_chains(view, syntax_name, direction)
+    key = (region.begin(), region.end())
+    if key not in chains and len(chains) < max_cached_chains:
+        chains[key] = regions
+
+
+def compute_regions(view: sublime.View, pt: int, syntax_name: str, direction='outward'):
+    "Parses document and returns regions for balancing"
     content = get_content(view)
 
     if syntax.is_css(syntax_name):
@@ -69,13 +111,19 @@ def balance_outward(view, syntax_name):
     result = []
 
     for sel in view.sel():
-        regions = get_regions(view, sel.begin(), syntax_name, 'outward')
+        regions = get_chains(view, syntax_name, 'outward').get((sel.begin(), sel.end())) or \
+            get_regions(view, sel.begin(), syntax_name, 'outward')
         target_region = sel
         for r in regions:
             if r.contains(sel) and r.end() > sel.end():
                 target_region = r
                 break
 
+        if target_region != sel:
+            # Every region which contains target region contains initial
+            # location as well, reuse regions if user balances outward
+            # again without changing selection
+            remember_regions(view, target_region, syntax_name, 'outward', regions)
         result.append(target_region)
 
     return result
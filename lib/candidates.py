@@ -0,0 +1,124 @@
+import re
+from ..emmet.config import Config
+from .config import get_settings_revision
+from .utils import known_tags
+
+__doc__ = """
+Classifier of single-word abbreviation candidates: checks if typed word is
+a known tag or Emmet snippet or may become one if user continues typing
+"""
+
+lorem_prefix = 'lorem'
+complex_chars = frozenset('.#>^+*[({/')
+re_word = re.compile(r'^[a-zA-Z][\w\-:]*$')
+
+_classifiers = {}
+_classifiers_revision = None
+
+
+class PrefixTrie:
+    "A prefix tree of strings"
+    __slots__ = ('root',)
+
+    def __init__(self, words=None):
+        self.root = {}
+        if words:
+            for word in words:
+                self.add(word)
+
+    def add(self, word: str):
+        node = self.root
+        for ch in word:
+            child = node.get(ch)
+            if child is None:
+                child = node[ch] = {}
+            node = child
+        # Empty string key marks the end of word
+        node[''] = word
+
+    def find(self, prefix: str) -> dict:
+        "Returns trie node for given prefix, if any"
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def has_prefix(self, prefix: str) -> bool:
+        "Check if any of stored words starts with given prefix"
+        return self.find(prefix) is not None
+
+    def words(self, prefix: str, limit=0) -> list:
+        "Returns stored words which start with given prefix"
+        result = []
+        node = self.find(prefix)
+        if node is not None:
+            stack = [node]
+            while stack:
+                node = stack.pop()
+                for ch, child in node.items():
+                    if ch:
+                        stack.append(child)
+                    else:
+                        result.append(child)
+                        if len(result) == limit:
+                            return result
+        return result
+
+
+class CandidateClassifier:
+    "Classifies single-word abbreviations for syntax with known snippets only"
+    __slots__ = ('tags', 'snippets', 'names')
+
+    def __init__(self, snippets: dict):
+        self.tags = known_tags
+        self.snippets = frozenset(snippets.keys())
+        self.names = PrefixTrie(self.tags | self.snippets)
+
+    def is_candidate(self, abbr: str) -> bool:
+        "Check if given word is a valid candidate for Emmet abbreviation"
+        # * contains dash (web components)
+        # * upper-cased (JSX, Svelte components)
+        # * known HTML tags
+        # * known Emmet snippets
+        return '-' in abbr \
+            or (abbr and abbr[0].isupper()) \
+            or abbr in self.tags \
+            or abbr in self.snippets \
+            or abbr.startswith(lorem_prefix)
+
+    def is_candidate_prefix(self, abbr: str) -> bool:
+        """
+        Check if given word is either a valid candidate or may become one
+        if user continues typing it
+        """
+        return self.is_candidate(abbr) \
+            or lorem_prefix.startswith(abbr) \
+            or self.names.has_prefix(abbr)
+
+
+def is_complex(abbr: str) -> bool:
+    "Check if given abbreviation contains operators, e.g. it’s not a single word"
+    return not complex_chars.isdisjoint(abbr)
+
+
+def is_word(abbr: str) -> bool:
+    "Check if given abbreviation consists of tag or snippet name characters only"
+    return re_word.match(abbr) is not None
+
+
+def get_classifier(config: Config) -> CandidateClassifier:
+    "Returns candidate classifier for syntax of given config"
+    global _classifiers, _classifiers_revision
+
+    revision = get_settings_revision()
+    if revision != _classifiers_revision:
+        _classifiers = {}
+        _classifiers_revision = revision
+
+    classifier = _classifiers.get(config.syntax)
+    if classifier is None:
+        classifier = _classifiers[config.syntax] = CandidateClassifier(config.snippets)
+
+    return classifier
@@ -1,7 +1,8 @@
 import sublime
 from . import emmet_sublime as emmet
 from . import syntax
-from .utils import get_content, get_caret
+from .utils import get_content, get_caret, BufferReader
+from .context import get_embedded_stylesheet
 from ..emmet.css_matcher import match as match_css
 
 html_comment = {
@@ -15,21 +16,21 @@ css_comment = {
 }
 
 comment_selector = 'comment'
-embedded_style = 'source.css.embedded | source.less.embedded | source.scss.embedded | source.sass.embedded | source.sss.embedded'
 
 def remove_comments(view: sublime.View, edit: sublime.Edit, region: sublime.Region, tokens: dict):
     "Removes comment markers from given region. Returns amount of characters removed"
-    text = view.substr(region)
+    reader = BufferReader(view)
+    text = reader.substr(region.begin(), region.end())
 
     if text.startswith(tokens['start']) and text.endswith(tokens['end']):
         start_offset = region.begin() + len(tokens['start'])
         end_offset = region.end() - len(tokens['end'])
 
         # Narrow down offsets for whitespace
-        if view.substr(start_offset).isspace():
+        if reader.char(start_offset).isspace():
             start_offset += 1
 
-        if view.substr(end_offset - 1).isspace():
+        if reader.char(end_offset - 1).isspace():
             end_offset -= 1
 
         start_region = sublime.Region(region.begin(), start_offset)
@@ -52,17 +53,9 @@ def get_range_for_comment(view: sublime.View, pt: int):
     "Returns tag range for given text position, if possible"
     syntax_name = syntax.from_pos(view, pt)
     if syntax.is_css(syntax_name):
-        offset = 0
-        inner_region = None
-        if view.match_selector(pt, embedded_style):
-            # Looks like embedded CSS, find matching region
-            for r in view.find_by_selector(embedded_style):
-                if r.contains(pt):
-                    inner_region = r
-                    offset = r.begin()
-                    break
-
-
+        # Looks like embedded CSS, find matching region
+        inner_region = get_embedded_stylesheet(view, pt)
+        offset = inner_region.begin() if inner_region else 0
         content = view.substr(inner_region) if inner_region else get_content(view)
         m = match_css(content, pt - offset)
         if m:
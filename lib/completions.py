@@ -0,0 +1,113 @@
+import json
+import sublime
+from ..emmet.config import Config
+from . import syntax
+from .candidates import PrefixTrie
+from .config import get_config, get_settings, get_settings_revision
+from .emmet_sublime import expand
+
+__doc__ = "Emmet snippet completions for native auto-complete popup"
+
+max_completions = 100
+max_preview_len = 40
+max_cached_outputs = 16
+"Max amount of distinct output configs with cached completion items per syntax"
+
+no_completion = object()
+"Marker of cached snippet which produces no completion item"
+
+_indexes = {}
+_indexes_revision = None
+
+
+class SnippetIndex:
+    "Prefix index of resolved Emmet snippets for a single syntax"
+    __slots__ = ('names', 'snippets', 'completions')
+
+    def __init__(self, snippets: dict):
+        self.names = PrefixTrie(snippets.keys())
+        self.snippets = snippets
+        self.completions = {}
+        "Lazily created completion items for snippet names, keyed by output config"
+
+    def query(self, prefix: str, config: Config, limit=max_completions) -> list:
+        "Returns completion items for snippets which names start with given prefix"
+        items = self.get_items(config)
+        result = []
+        for name in self.names.words(prefix, limit):
+            item = items.get(name, no_completion)
+            if item is no_completion:
+                item = items[name] = create_completion(name, self.snippets[name], config)
+            if item:
+                result.append(item)
+
+        return result
+
+    def get_items(self, config: Config) -> dict:
+        "Returns cache of completion items for output produced with given config"
+        key = output_key(config)
+        items = self.completions.get(key)
+        if items is None:
+            if len(self.completions) >= max_cached_outputs:
+                self.completions.clear()
+            items = self.completions[key] = {}
+        return items
+
+
+def allow_completions(view: sublime.View, pos: int, prefix: str) -> bool:
+    "Check if Emmet snippet completions are available for given prefix at given location"
+    return bool(prefix) and get_settings('snippet_completions', False) \
+        and syntax.in_activation_scope(view, pos) \
+        and syntax.is_supported(syntax.from_pos(view, pos))
+
+
+def get_completions(view: sublime.View, pos: int, prefix: str) -> list:
+    "Returns Emmet snippet completions for given prefix at given location in view"
+    if not allow_completions(view, pos, prefix):
+        return []
+
+    config = get_config(view, pos)
+    return get_index(config).query(prefix, config)
+
+
+def get_index(config: Config) -> SnippetIndex:
+    "Returns snippet index for syntax of given config"
+    global _indexes, _indexes_revision
+
+    revision = get_settings_revision()
+    if revision != _indexes_revision:
+        _indexes = {}
+        _indexes_revision = revision
+
+    index = _indexes.get(config.syntax)
+    if index is None:
+        index = _indexes[config.syntax] = SnippetIndex(config.snippets)
+
+    return index
+
+
+def output_key(config: Config) -> str:
+    "Returns key of config options which affect expanded snippet"
+    return json.dumps([config.type, config.syntax, config.context, config.options],
+                      sort_keys=True, default=repr)
+
+
+def create_completion(name: str, value, config: Config) -> tuple:
+    "Creates completion item for given snippet"
+    try:
+        snippet = expand(name, config)
+    except:
+        return None
+
+    if not snippet:
+        return None
+
+    return ('%s\t%s' % (name, snippet_preview(value)), snippet)
+
+
+def snippet_preview(value) -> str:
+    "Returns short single-line preview of given snippet value"
+    preview = ' '.join(str(value).split())
+    if len(preview) > max_preview_len:
+        preview = '%s...' % preview[0:max_preview_len]
+    return preview
@@ -1,11 +1,15 @@
 import sublime
 from . import syntax
+from .snippet_cache import PersistentCache
 from ..emmet import Config
 
 # Cache for storing internal Emmet data
-emmet_cache = {}
+emmet_cache = None
 settings = None
 
+# Incremented on every settings change, used to invalidate data derived from settings
+settings_revision = 0
+
 def get_settings(key: str, default=None):
     "Returns value of given Emmet setting"
     global settings
@@ -18,8 +22,25 @@ def get_settings(key: str, default=None):
 
 
 def handle_settings_change():
+    global emmet_cache, settings_revision
+    emmet_cache = None
+    settings_revision += 1
+    syntax.reset_scope_memo()
+
+
+def get_settings_revision() -> int:
+    "Returns revision of Emmet settings"
+    return settings_revision
+
+
+def get_emmet_cache() -> PersistentCache:
+    "Returns cache for internal Emmet data, restored from disk if possible"
     global emmet_cache
-    emmet_cache = {}
+
+    if emmet_cache is None:
+        emmet_cache = PersistentCache(get_settings('config'))
+
+    return emmet_cache
 
 
 def get_user_css() -> str:
@@ -50,7 +71,7 @@ def get_config(view: sublime.View, pos: int, params: dict = None) -> Config:
         'type': syntax.get_type(syntax_name),
         'syntax': syntax_name or 'html',
         'options': options,
-        'cache': emmet_cache
+        'cache': get_emmet_cache()
     }
     if params:
         payload.update(params)
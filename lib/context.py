@@ -1,7 +1,11 @@
+import re
+from copy import copy
+from itertools import islice
 import sublime
-from .utils import  get_content, attribute_value
-from .config import get_config
+from .utils import  attribute_value, BufferReader
+from .config import get_config, get_settings_revision
 from . import syntax
+from . import view_state
 from ..emmet.config import Config
 from ..emmet.html_matcher import attributes
 from ..emmet.css_matcher import scan as scan_css, TokenType
@@ -13,7 +17,80 @@ self_close = (
 )
 "A list of self-closing HTML tags"
 
+embedded_style = 'source.css.embedded | source.less.embedded | source.scss.embedded | source.sass.embedded | source.sss.embedded'
+"Selector of stylesheets embedded into other documents"
+
+css_section_selector = 'meta.selector, meta.property-list'
+
+css_media_selector = 'meta.at-rule.media | meta.at-rule.supports'
+
+css_property_list_selector = 'meta.property-list'
+
+native_css_syntaxes = ('scss', 'less')
+"Stylesheet syntaxes which have the same section scopes as CSS"
+
+html_context_window = 16384
+"Size of text window around location where enclosing tag is searched first"
+
+html_checkpoint_interval = 65536
+"Distance between saved tag stacks of full HTML document scan"
+
+css_checkpoint_interval = 65536
+"Distance between saved scanner stacks of full CSS document scan"
+
+max_cached_contexts = 32
+"Max amount of cached activation contexts for a single view"
+
+re_css_block_end = re.compile(r'\}')
+
+re_css_paren = re.compile(r'/\*.*?(?:\*/|\Z)|(["\'])(?:\\.|(?!\1)[^\\\r\n])*(?:\1|[\r\n])?|([()])', re.S)
+"Matches parentheses of CSS source, skipping comments and quoted strings"
+
+re_html_tag_start = re.compile(r'<(/?)([\w:.\-]+)')
+re_html_tag = re.compile(r'<(/?)([\w:.\-]+)(?:\s(?:[^>"\']|"[^"]*"|\'[^\']*\')*?)?(/?)>')
+
 def get_activation_context(editor: sublime.View, pos: int) -> Config:
+    """
+    Returns valid abbreviation activation context for given location in editor,
+    see `detect_activation_context()`. Detected contexts are cached for current
+    buffer revision, so the same location is analyzed once per keystroke.
+    Caller receives a copy of cached config and may modify it
+    """
+    # NB: may be invoked on async thread: cache contexts only in existing state
+    # of open view
+    state = view_state.get_view(editor)
+    if state is None or not editor.is_valid():
+        return detect_activation_context(editor, pos)
+
+    view_settings = editor.settings()
+    key = (editor.change_count(), get_settings_revision(),
+           view_settings.get('tab_size'), view_settings.get('translate_tabs_to_spaces'))
+    if state.contexts_key != key or len(state.contexts) >= max_cached_contexts:
+        state.contexts_key = key
+        state.contexts = {}
+
+    # Include scope name to detect syntax changes
+    ctx_key = (pos, editor.scope_name(pos))
+    if ctx_key not in state.contexts:
+        state.contexts[ctx_key] = detect_activation_context(editor, pos)
+
+    return copy_config(state.contexts[ctx_key])
+
+
+def copy_config(config: Config) -> Config:
+    "Returns copy of given config which can be modified without affecting original one"
+    if config is None:
+        return None
+
+    result = copy(config)
+    result.user_config = dict(config.user_config or {})
+    result.options = dict(config.options)
+    if isinstance(config.context, dict):
+        result.context = dict(config.context)
+    return result
+
+
+def detect_activation_context(editor: sublime.View, pos: int) -> Config:
     """
     Detects and returns valid abbreviation activation context for given location
     in editor which can be used for abbreviation expanding.
@@ -73,6 +150,95 @@ def get_html_context(editor: sublime.View, pos: int) -> dict:
         # Do not allow abbreviations inside tags or comments
         return None
 
+    ctx = fast_get_html_context(editor, pos)
+    if ctx is None:
+        ctx = scan_html_context(editor, pos)
+
+    return ctx
+
+
+def fast_get_html_context(editor: sublime.View, pos: int) -> dict:
+    """
+    Get Emmet abbreviation context for given location in HTML editor from tags
+    in text window around it. Returns `None` if context can’t be reliably
+    detected in window, in this case entire document must be scanned
+    with `scan_html_context()`
+    """
+    start = max(0, pos - html_context_window)
+    end = min(editor.size(), pos + html_context_window)
+    text = editor.substr(sublime.Region(start, end))
+    is_html = editor.match_selector(pos, 'text.html')
+    before = []
+    after = []
+
+    for m in re_html_tag_start.finditer(text):
+        if not editor.match_selector(start + m.start(2), 'entity.name.tag'):
+            # Not a tag: text inside comment, script, attribute value etc.
+            continue
+
+        tag = re_html_tag.match(text, m.start())
+        if not tag or not editor.match_selector(start + tag.end() - 1, 'punctuation.definition.tag.end'):
+            # Unable to find tag end: either tag is cut by window bounds
+            # or contains unexpected syntax
+            return None
+
+        if start + tag.end() <= pos:
+            before.append(tag)
+        elif start + tag.start() >= pos:
+            after.append(tag)
+        else:
+            return None
+
+    # Find innermost open tag before location: every closing tag must have
+    # a matching open tag, otherwise document must be scanned entirely
+    # to handle unclosed tags
+    closing = []
+    open_tag = None
+    for tag in reversed(before):
+        name = tag.group(2)
+        if tag.group(1):
+            closing.append(name)
+        elif tag.group(3) or (is_html and name in self_close):
+            continue
+        elif closing:
+            if closing.pop() != name:
+                return None
+        else:
+            open_tag = tag
+            break
+
+    if open_tag is None:
+        # No enclosing tag: it’s a reliable result only if window covers
+        # document start and all tags are balanced
+        return {} if start == 0 and not closing else None
+
+    # Find closing tag for matched open tag
+    name = open_tag.group(2)
+    opening = []
+    for tag in after:
+        tag_name = tag.group(2)
+        if tag.group(1):
+            if opening:
+                if opening.pop() != tag_name:
+                    return None
+            elif tag_name == name:
+                region = sublime.Region(start + open_tag.start(), start + open_tag.end())
+                return create_tag_context(editor, name, region)
+            else:
+                return None
+        elif not tag.group(3) and not (is_html and tag_name in self_close):
+            opening.append(tag_name)
+
+    return None
+
+
+def scan_html_context(editor: sublime.View, pos: int) -> dict:
+    """
+    Get Emmet abbreviation context for given location in HTML editor
+    by scanning tags of entire document. Stack of open tags is saved at
+    checkpoints during scan, so next scans of the same buffer resume
+    from the nearest checkpoint instead of document start
+    """
     # In ST3, `view.find_by_selector()` will merge adjacent regions.
     # For example, passing `entity.name.tag` selector will return a single
     # range for `<span></span>`. Since we can easily detect tag start, we’ll
@@ -85,7 +251,21 @@ def get_html_context(editor: sublime.View, pos: int) -> dict:
     regions = editor.find_by_selector('entity.name.tag, punctuation.definition.tag.end')
     pending = None
 
-    for r in regions:
+    # NB: tags before checkpoint can’t produce context for locations after it
+    checkpoints = view_state.get_checkpoints(editor, 'html' if is_html else 'xml')
+    offset, saved_stack = checkpoints.find(pos)
+    if saved_stack:
+        stack = [{'name': name, 'region': sublime.Region(a, b)} for name, a, b in saved_stack]
+    next_checkpoint = offset + html_checkpoint_interval
+    last_end = offset
+
+    for r in islice(regions, find_region_index(regions, offset), None):
+        if pending is None and r.begin() >= next_checkpoint:
+            # Stack of open tags depends on content before current tag only
+            checkpoints.add(last_end, tuple((item['name'], item['region'].a, item['region'].b) for item in stack))
+            next_checkpoint = last_end + html_checkpoint_interval
+
+        last_end = r.end()
         val = editor.substr(r)
         if val in ('>', '/>'):
             # It’s a closing punctuator for open tag
@@ -141,14 +321,26 @@ def get_html_context(editor: sublime.View, pos: int) -> dict:
     return {}
 
 
+def find_region_index(regions: list, pos: int) -> int:
+    "Returns index of the first region in sorted list which starts at or after given location"
+    lo = 0
+    hi = len(regions)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if regions[mid].begin() < pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
 def fast_get_css_context(editor: sublime.View, pos: int):
     "Get CSS context using native ST API, but might be less accurate than get_css_context()"
     # Check for edge case: typing abbreviation inside media expression,
     # e.g. `@media (|) { ... }`
     r = None
     text = ''
-    sel_at_rule = 'meta.at-rule.media | meta.at-rule.supports'
-    if editor.match_selector(pos, sel_at_rule):
+    if editor.match_selector(pos, css_media_selector):
         r = editor.expand_to_scope(pos, 'meta.group')
         if not r:
             start = pos
@@ -177,70 +369,133 @@ def fast_get_css_context(editor: sublime.View, pos: int):
 
 
 def get_matching_section(view: sublime.View, pos: int):
-    for r in get_section_regions(view):
-        if r.contains(pos):
-            return r
+    "Returns CSS section region (selector or property list) for given location"
+    return view_state.get_region_index(view, css_section_selector, get_section_regions).find(pos)
 
 
 def get_section_regions(view: sublime.View):
+    "Returns sorted list of CSS section regions (selectors and property lists) in given view"
     result = []
-    regions = view.find_by_selector('meta.selector, meta.property-list')
-    max_size = view.size()
+    regions = view.find_by_selector(css_section_selector)
+    reader = BufferReader(view)
 
-    for r in regions:
+    for i, r in enumerate(regions):
         start = r.begin()
         end = r.end()
 
         # a region may start with whitespace
-        while start < end and view.substr(start).isspace():
-            start += 1
+        start = reader.scan_forward(start, end, str.isspace)
 
-        # Find terminating
-        while end > max_size and view.substr(end) != '}':
-            end += 1
+        if start < end and reader.char(start) == '{' and reader.char(end - 1) != '}':
+            # Unterminated property list: extend it up to closing brace
+            # but not further than next section
+            limit = regions[i + 1].begin() if i + 1 < len(regions) else reader.size
+            close = reader.search(re_css_block_end, end, limit)
+            end = close.end() if close else limit
 
         result.append(sublime.Region(start, end))
 
     return result
 
 
-def search_css_context(content: str, pos: int):
-    "Searches for Emmet CSS context in content at given location"
+def get_embedded_stylesheet(view: sublime.View, pos: int) -> sublime.Region:
+    "Returns region of stylesheet embedded into other document at given location, if any"
+    if view.match_selector(pos, embedded_style):
+        return view_state.get_region_index(view, embedded_style).find(pos)
+    return None
+
+
+class CSSItem:
+    "Token of CSS document structure"
+    __slots__ = ('type', 'region')
+
+    def __init__(self, token_type: str, start: int, end: int):
+        self.type = token_type
+        self.region = sublime.Region(start, end)
+
+
+def search_css_context(content: str, pos: int, offset=0, stack=None, checkpoints=None) -> dict:
+    """
+    Searches for Emmet CSS context in content at given location.
+    If `offset` is given, `content` is a document text starting at this offset
+    and `stack` is a stack of scanner items before it. All locations are
+    document-relative. If `checkpoints` are given, scanner stack is saved
+    at block ends into it
+    """
     state = {
         'current': None,
-        'pool': [],
-        'stack': []
+        'stack': list(stack) if stack else []
     }
+    item_stack = state['stack']
+    next_checkpoint = offset + css_checkpoint_interval
+    # Scanner doesn’t reset its parentheses counter, so we have to track it
+    # to save checkpoints at balanced locations only
+    parens = 0
+    parens_pos = 0
 
     def scan_callback(token_type: str, start: int, end: int, delimiter: int):
+        nonlocal next_checkpoint, parens, parens_pos
+        start += offset
+        end += offset
+
         if start >= pos:
             # Token behind specified location, stop parsing
             return False
 
         if start < pos <= end:
             # Direct hit on token
-            state['current'] = {
-                'type': token_type,
-                'region': sublime.Region(start, end)
-            }
+            state['current'] = CSSItem(token_type, start, end)
             return False
 
         if token_type in (TokenType.Selector, TokenType.PropertyName):
-            state['stack'].append(alloc_css_item(state['pool'], token_type, start, end))
-        elif token_type in (TokenType.PropertyValue, TokenType.BlockEnd) and state['stack']:
-            release_css_item(state['pool'], state['stack'].pop())
+            item_stack.append(CSSItem(token_type, start, end))
+        elif token_type in (TokenType.PropertyValue, TokenType.BlockEnd) and item_stack:
+            item_stack.pop()
+
+        if token_type == TokenType.BlockEnd and checkpoints is not None and end >= next_checkpoint:
+            parens += count_parens(content, parens_pos, end - offset)
+            parens_pos = end - offset
+            if not parens:
+                # Scanner state is reset at block end, so we can resume from here.
+                # Stack items are never modified and can be shared
+                checkpoints.add(end, tuple(item_stack))
+                next_checkpoint = end + css_checkpoint_interval
 
     scan_css(content, scan_callback)
 
     return state
 
 
-def text_substr(text: str, r: sublime.Region) -> str:
-    return text[r.begin():r.end()]
+def count_parens(text: str, start: int, end: int) -> int:
+    "Returns balance of parentheses in given range of CSS source"
+    result = 0
+    for m in re_css_paren.finditer(text, start, end):
+        paren = m.group(2)
+        if paren == '(':
+            result += 1
+        elif paren == ')':
+            result -= 1
+    return result
 
 
-def get_css_context_from_text(text: str, pos: int):
-    state = search_css_context(text, pos)
+def scan_css_context(editor: sublime.View, pos: int):
+    """
+    Get CSS context for given location by scanning editor contents. Scanner
+    stack is saved at checkpoints during scan, so next scans of the same
+    buffer resume from the nearest checkpoint instead of document start
+    """
+    checkpoints = view_state.get_checkpoints(editor, 'css')
+    offset, stack = checkpoints.find(pos)
+    text = editor.substr(sublime.Region(offset, editor.size()))
+    return get_css_context_from_text(text, pos, offset, stack, checkpoints)
+
+
+def text_substr(text: str, r: sublime.Region, offset=0) -> str:
+    return text[r.begin() - offset:r.end() - offset]
+
+
+def get_css_context_from_text(text: str, pos: int, offset=0, stack=None, checkpoints=None):
+    state = search_css_context(text, pos, offset, stack, checkpoints)
 
     # CSS abbreviations can be activated only when a character is entered, e.g.
     # it should be either property name or value.
@@ -253,50 +508,64 @@ def get_css_context_from_text(text: str, pos: int):
 
     # Check for edge case: typing abbreviation inside media expression,
     # e.g. `@media (|) { ... }`
-    if cur['type'] == TokenType.Selector:
-        value = text_substr(text, cur['region'])
-        if value.startswith('@media') and in_media_expression(value, pos - cur['region'].begin()):
+    if cur.type == TokenType.Selector:
+        value = text_substr(text, cur.region, offset)
+        if value.startswith('@media') and in_media_expression(value, pos - cur.region.begin()):
             return {'name': CSSAbbreviationScope.Property}
 
-    if cur['type'] in (TokenType.PropertyName, TokenType.PropertyValue) or \
-        is_typing_before_selector(text, pos, cur):
+    if cur.type in (TokenType.PropertyName, TokenType.PropertyValue) or \
+        is_typing_before_selector(text, pos, cur, offset):
 
         parent = stack[-1] if stack else None
         scope = CSSAbbreviationScope.Global
 
         if cur:
-            if cur['type'] == TokenType.PropertyValue:
-                prefix = text[pos - 1]
-                value = text_substr(text, cur['region'])
+            if cur.type == TokenType.PropertyValue:
+                prefix = text[pos - offset - 1]
+                value = text_substr(text, cur.region, offset)
                 allowed_prefixes = '!#'
                 if prefix not in allowed_prefixes and value[0] not in allowed_prefixes:
                     # For value scope, allow color abbreviations only and important
                     # modifiers. For all other cases, delegate to native completions
                     return None
-                if parent:
-                    value = text_substr(text, parent['region'])
-            elif cur['type'] in (TokenType.Selector, TokenType.PropertyName) and not parent:
+            elif cur.type in (TokenType.Selector, TokenType.PropertyName) and not parent:
                 scope = CSSAbbreviationScope.Section
 
         return {'name': scope}
 
 def get_css_context(editor: sublime.View, pos: int):
-    if syntax.doc_syntax(editor) == 'css':
+    doc_syntax = syntax.doc_syntax(editor)
+    if doc_syntax == 'css':
+        return fast_get_css_context(editor, pos)
+
+    if doc_syntax in native_css_syntaxes and \
+        (editor.match_selector(pos, css_media_selector) or \
+            (editor.match_selector(pos, css_property_list_selector) and get_matching_section(editor, pos))):
+        # Nested sections are covered by top-level property list, so it’s
+        # safe to use native scopes here. Top-level selectors and preprocessor
+        # constructs outside of sections (variables, mixin calls etc.) are
+        # handled by document scan
         return fast_get_css_context(editor, pos)
 
-    return get_css_context_from_text(get_content(editor), pos)
+    inner_region = get_embedded_stylesheet(editor, pos)
+    if inner_region:
+        # Stylesheet embedded into other document, e.g. `<style>` in HTML:
+        # scan its contents only
+        return get_css_context_from_text(editor.substr(inner_region), pos, inner_region.begin())
 
+    return scan_css_context(editor, pos)
 
-def is_typing_before_selector(text: str, pos: int, ctx: dict) -> bool:
+
+def is_typing_before_selector(text: str, pos: int, ctx: CSSItem, offset=0) -> bool:
     """
     Handle edge case: start typing abbreviation before selector. In this case,
     entered character becomes part of selector
     Activate only if it’s a nested section and it’s a first character of selector
     """
-    if ctx and ctx['type'] == TokenType.Selector and ctx['region'].begin() == pos - 1:
+    if ctx and ctx.type == TokenType.Selector and ctx.region.begin() == pos - 1:
         # Typing abbreviation before selector is tricky one:
         # ensure it’s on its own line
-        line = text_substr(text, ctx['region']).splitlines()[0]
+        line = text_substr(text, ctx.region, offset).splitlines()[0]
         return len(line.strip()) == 1
 
     return False
@@ -321,25 +590,6 @@ def pop_tag_stack(stack: list, tag: str, pool):
             return item
 
 
-def alloc_css_item(pool: list, token_type: str, start: int, end: int):
-    if pool:
-        item = pool.pop()
-        item['type'] = token_type
-        item['region'].a = start
-        item['region'].b = end
-    else:
-        item = {
-            'type': token_type,
-            'region': sublime.Region(start, end)
-        }
-
-    return item
-
-def release_css_item(pool: list, item: dict):
-    if item is not None:
-        pool.append(item)
-
-
 def parse_html_attributes(editor: sublime.View, name: str, open_tag: sublime.Region) -> dict:
     "Parses attributes of given open tag"
     attrs = {}
@@ -1,7 +1,13 @@
 import re
 import sublime
-from ..emmet import expand as expand_abbreviation, extract, Config
-from ..emmet.html_matcher import match, balanced_inward, balanced_outward
+from ..emmet import expand as expand_abbreviation, extract, Config, markup_abbreviation, \
+    stringify_markup
+from ..emmet.abbreviation.tokenizer import tokenize
+from ..emmet.abbreviation.parser import parse as parse_tokens
+from ..emmet.abbreviation.convert import convert
+from ..emmet.extract_abbreviation import offset_past_auto_closed
+from ..emmet.html_matcher import match, balanced_inward, balanced_outward, scan, \
+    get_attributes, is_self_close, MatchedTag, ScannerOptions, ElementType
 from ..emmet.css_matcher import balanced_inward as css_balanced_inward, \
     balanced_outward as css_balanced_outward
 from ..emmet.action_utils import select_item_css, select_item_html, \
@@ -11,6 +17,21 @@ from . import syntax
 from .config import get_settings, get_config
 from .utils import to_region
 
+max_abbreviation_length = 1000
+"Max length of abbreviation text extracted from line before caret"
+
+max_look_ahead_length = 100
+"Max amount of auto-closed characters after caret to look ahead when extracting abbreviation"
+
+visible_margin = 8192
+"Amount of characters around visible region to parse for caret-driven features"
+
+max_window_lines = 50
+"Max amount of lines to look back for location where parsing of a window can start"
+
+unsafe_start_selector = 'meta.tag | comment | source | string'
+"Scopes where markup parsing can’t start since text is not a plain tag content"
+
 def escape_text(text: str, **kwargs):
     "Escapes all `$` in plain text for snippet output"
     return re.sub(r'\$', '\\$', text)
@@ -20,6 +41,26 @@ def expand(abbr: str, config: dict):
     return expand_abbreviation(abbr, config, get_settings('config'))
 
 
+def parse_markup(abbr: str, config: Config):
+    """
+    Parses given markup abbreviation into token tree which can be expanded
+    multiple times with different configs and texts with `expand_parsed()`
+    """
+    return parse_tokens(tokenize(abbr), { 'jsx': bool(config.options.get('jsx.enabled')) })
+
+
+def expand_parsed(tokens, config: Config) -> str:
+    "Expands markup abbreviation token tree, parsed with `parse_markup()`, with given config"
+    abbr = convert(tokens, {
+        'text': config.get('text'),
+        'variables': config.variables,
+        'options': config.options,
+        'max_repeat': config.get('maxRepeat') or config.get('max_repeat'),
+        'href': config.options.get('markup.href')
+    })
+    return stringify_markup(markup_abbreviation(abbr, config), config)
+
+
 def balance(code: str, pos: int, direction: str, xml=False) -> list:
     "Returns list of tags for balancing for given code"
     options = { 'xml': xml }
@@ -75,28 +116,94 @@ def evaluate_math(code: str, pos: int, options=None):
             pass
 
 
-def get_tag_context(view: sublime.View, pt: int, xml=None) -> dict:
-    "Returns matched HTML/XML tag for given point in view"
+def get_local_tag_context(view: sublime.View, pt: int, xml=None, should_stop=None) -> dict:
+    """
+    Same as `get_tag_context()` but parses visible region with margins first.
+    Whole document is parsed only if matched tag is not found in it
+    """
+    window = get_parse_window(view, pt)
+    if window:
+        # Tags matched inside window are the same as in whole document:
+        # window starts with plain text, so only unclosed tags before window
+        # are missing, and tag containing location must be closed before them
+        ctx = get_tag_context(view, pt, xml, should_stop, window)
+        if ctx:
+            return ctx
+
+    return get_tag_context(view, pt, xml, should_stop)
+
+
+def get_parse_window(view: sublime.View, pt: int) -> sublime.Region:
+    """
+    Returns region around visible part of view and given location where
+    markup can be parsed separately from the rest of document: region starts
+    and ends with plain text. Returns `None` if window doesn’t save much
+    compared to parsing whole document
+    """
+    visible = view.visible_region()
+    size = view.size()
+    begin = max(0, min(visible.begin(), pt) - visible_margin)
+    end = min(size, max(visible.end(), pt) + visible_margin)
+    if begin == 0 and end == size:
+        return None
+
+    # Find beginning of line with plain text
+    begin = view.line(begin).begin()
+    for _ in range(max_window_lines):
+        if begin == 0 or not view.match_selector(begin, unsafe_start_selector):
+            break
+        begin = view.line(begin - 1).begin()
+    else:
+        begin = 0
+
+    # ...and end of line with plain text
+    end = view.line(end).end()
+    for _ in range(max_window_lines):
+        if end >= size or not view.match_selector(end, unsafe_start_selector):
+            break
+        end = view.line(end + 1).end()
+    else:
+        end = size
+
+    if begin == 0 and end >= size:
+        return None
+    return sublime.Region(begin, min(end, size))
+
+
+def get_tag_context(view: sublime.View, pt: int, xml=None, should_stop=None,
+                    region: sublime.Region = None) -> dict:
+    """
+    Returns matched HTML/XML tag for given point in view. If `should_stop`
+    function is given, it’s invoked for every scanned tag and matching is
+    aborted as soon as it returns `True`. If `region` is given, only its
+    contents is parsed
+    """
     ctx = None
-    content = view.substr(sublime.Region(0, view.size()))
+    if region is None:
+        region = sublime.Region(0, view.size())
+    offset = region.begin()
+    content = view.substr(region)
 
     if xml is None:
         # Autodetect XML dialect
         syntax_name = syntax.from_pos(view, pt)
         xml = syntax.is_xml(syntax_name)
 
-    matched_tag = match(content, pt, {'xml': xml})
+    if should_stop:
+        matched_tag = match_interruptible(content, pt - offset, {'xml': xml}, should_stop)
+    else:
+        matched_tag = match(content, pt - offset, {'xml': xml})
     if matched_tag:
         open_tag = matched_tag.open
         close_tag = matched_tag.close
         ctx = {
             'name': matched_tag.name,
             'attributes': {},
-            'open': to_region(open_tag),
+            'open': sublime.Region(open_tag[0] + offset, open_tag[1] + offset),
         }
 
         if close_tag:
-            ctx['close'] = to_region(close_tag)
+            ctx['close'] = sublime.Region(close_tag[0] + offset, close_tag[1] + offset)
 
         for attr in matched_tag.attributes:
             name = attr.name
@@ -109,6 +216,38 @@ def get_tag_context(view: sublime.View, pt: int, xml=None) -> dict:
     return ctx
 
 
+def match_interruptible(source: str, pos: int, opt: dict, should_stop: callable) -> MatchedTag:
+    """
+    Same as `match()` from HTML matcher but stops scanning source
+    when `should_stop()` returns `True`
+    """
+    stack = []
+    options = ScannerOptions(opt)
+    result = [None]
+
+    def scan_callback(name: str, elem_type: ElementType, start: int, end: int):
+        if should_stop():
+            return False
+
+        if elem_type == ElementType.Open and is_self_close(name, options):
+            elem_type = ElementType.SelfClose
+
+        if elem_type == ElementType.Open:
+            stack.append((name, start, end))
+        elif elem_type == ElementType.SelfClose:
+            if start < pos < end:
+                result[0] = MatchedTag(name, get_attributes(source, start, end, name), (start, end))
+                return False
+        elif stack and stack[-1][0] == name:
+            _, tag_start, tag_end = stack.pop()
+            if tag_start < pos < end:
+                result[0] = MatchedTag(name, get_attributes(source, tag_start, tag_end, name), (tag_start, tag_end), (start, end))
+                return False
+
+    scan(source, scan_callback, options.special)
+    return result[0]
+
+
 def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
     """
     Extracts abbreviation from given location in view. Locations could be either
@@ -116,6 +255,7 @@ def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
     """
     pt = -1
     region = None
+    line_start = None
     look_ahead = config.type != 'stylesheet'
     is_jsx = syntax.is_jsx(config.syntax)
     prefix = get_jsx_prefix() if is_jsx else None
@@ -124,9 +264,14 @@ def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
         loc = to_region(loc)
 
     if isinstance(loc, int):
-        # Character location is passed, extract from line
+        # Character location is passed, extract from line. Read a bounded
+        # window around location only: lines of minified code may be huge
+        # but abbreviation can’t be that long
         pt = loc
-        region = view.line(pt)
+        line = view.line(pt)
+        line_start = line.begin()
+        region = sublime.Region(max(line_start, pt - max_abbreviation_length),
+                                min(line.end(), pt + max_look_ahead_length))
 
         # https://github.com/emmetio/sublime-text-plugin/issues/185
         # Handle edge case when abbreviation is extracted in JSX attribute.
@@ -137,6 +282,7 @@ def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
             value_region = view.expand_to_scope(pt, 'source.js.embedded')
             if value_region:
                 region = value_region
+                line_start = None
     elif isinstance(loc, sublime.Region):
         # Extract from given range
         pt = loc.end()
@@ -151,6 +297,11 @@ def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
     if config is None:
         config = get_config(view, pt)
 
+    if look_ahead and offset_past_auto_closed(text, abbr_pos, {'type': config.type}) == abbr_pos:
+        # There are no auto-closed characters after location, extraction
+        # with and without look-ahead will produce the same result
+        look_ahead = False
+
     abbr_data = extract(text, abbr_pos, {
         'type': config.type,
         # No look-ahead for stylesheets: they do not support brackets syntax
@@ -174,6 +325,11 @@ def extract_abbreviation(view: sublime.View, loc: int, config: Config = None):
         if prefix and text[abbr_data.location - len(prefix):abbr_data.location] != prefix:
             return None
 
+        if abbr_data.start == 0 and line_start is not None and begin > line_start:
+            # Extraction reached the beginning of truncated line window:
+            # abbreviation is longer than allowed and can’t be expanded properly
+            return None
+
         abbr_data.start += begin
         abbr_data.end += begin
         abbr_data.location += begin
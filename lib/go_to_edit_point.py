@@ -1,27 +1,46 @@
+import re
+from bisect import bisect_left, bisect_right
 import sublime
+from .utils import get_content
+from . import view_state
+
+re_edit_point = re.compile(r'=(["\'])\1|>(?=<)|^[^\S\n]*\n', re.M)
 
 def find_new_edit_point(view: sublime.View, pos: int, inc: int) -> int:
-    doc_size = view.size()
-    cur_pos = pos
+    "Finds nearest edit point after (`inc > 0`) or before (`inc < 0`) given location"
+    if pos < 0 or pos >= view.size():
+        return None
 
-    while cur_pos < doc_size and cur_pos >= 0:
-        cur_pos += inc
-        cur_char = view.substr(cur_pos)
-        next_char = cur_pos < doc_size - 1 and view.substr(cur_pos + 1) or ''
-        prev_char = cur_pos > 0 and view.substr(cur_pos - 1) or ''
+    index = view_state.get_region_index(view, 'edit-points', get_edit_points)
+    if inc > 0:
+        ix = bisect_left(index.begins, pos + inc)
+    else:
+        ix = bisect_right(index.begins, pos + inc) - 1
 
-        if cur_char in '"\'' and next_char == cur_char and prev_char == '=':
-            # Empty attribute value
-            return cur_pos + 1
+    if 0 <= ix < len(index.regions):
+        return index.regions[ix].b
 
-        if cur_char == '<' and prev_char == '>':
-            # Between tags
-            return cur_pos
 
-        if cur_char in '\n\r':
-            line_region = view.line(cur_pos)
-            line = view.substr(line_region)
-            if not line or line.isspace():
-                # Empty line
-                return line_region.b
+def get_edit_points(view: sublime.View) -> list:
+    """
+    Returns sorted list of edit points in given view. Each edit point is a region
+    where `a` is a location which is checked when moving caret and `b`
+    is a caret location for it
+    """
+    result = []
+    for m in re_edit_point.finditer(get_content(view)):
+        ch = m.group(0)[0]
+        if ch == '=':
+            # Empty attribute value
+            pt = m.start() + 1
+            result.append(sublime.Region(pt, pt + 1))
+        elif ch == '>':
+            # Between tags
+            pt = m.start() + 1
+            result.append(sublime.Region(pt, pt))
+        else:
+            # Empty line
+            pt = m.end() - 1
+            result.append(sublime.Region(pt, pt))
 
+    return result
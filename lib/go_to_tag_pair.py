@@ -1,17 +1,22 @@
 import re
 import html
 import sublime
-from time import time
+from itertools import count
+from time import time, perf_counter
 from . import emmet_sublime as emmet
 from . import syntax
 from .utils import get_caret, go_to_pos
 from .telemetry import track_action
 from .config import get_user_css
+from . import view_state
 
-previews_by_buffer = {}
-phantoms_by_buffer = {}
 phantom_key = 'emmet_tag_preview'
 max_preview_len = 100
+max_close_tag_len = 256
+"Max length of closing tag text before caret to check if caret is inside it"
+
+re_close_tag_before = re.compile(r'</[^<>]*>?$')
+job_ids = count(1)
 tracking = {
     'last_event': 0,
     # Delay between tracking events, in seconds
@@ -20,12 +25,13 @@ tracking = {
 
 def show_tag_preview(view: sublime.View, pt: int, text: str, dest: int):
     "Displays given tag preview at `pt` location"
-    buffer_id = view.buffer_id()
-    if buffer_id not in phantoms_by_buffer:
-        phantom_set = sublime.PhantomSet(view, phantom_key)
-        phantoms_by_buffer[buffer_id] = phantom_set
-    else:
-        phantom_set = phantoms_by_buffer[buffer_id]
+    state = view_state.get_buffer(view)
+    if state is None or not view.is_valid():
+        return
+
+    if state.tag_phantoms is None:
+        state.tag_phantoms = sublime.PhantomSet(view, phantom_key)
+    phantom_set = state.tag_phantoms
 
     r = sublime.Region(pt, pt)
     nav = lambda href: go_to_pos(view, int(href))
@@ -35,19 +41,19 @@ def show_tag_preview(view: sublime.View, pt: int, text: str, dest: int):
 
 def hide_tag_preview(view: sublime.View):
     "Hides tag preview in given view"
-    buffer_id = view.buffer_id()
+    state = view_state.get_buffer(view)
 
-    if buffer_id in phantoms_by_buffer:
-        del phantoms_by_buffer[buffer_id]
+    if state and state.tag_phantoms is not None:
+        state.tag_phantoms = None
         view.erase_phantoms(phantom_key)
 
 
 def reset_tag_preview(view: sublime.View):
-    buffer_id = view.buffer_id()
-    if buffer_id in previews_by_buffer:
-        pt, visible = previews_by_buffer[buffer_id]
+    state = view_state.get_buffer(view)
+    if state and state.tag_preview:
+        pt, visible = state.tag_preview
         if visible:
-            previews_by_buffer[buffer_id] = (pt, False)
+            state.tag_preview = (pt, False)
 
 
 def phantom_content(content: str, dest: int):
@@ -79,26 +85,64 @@ def allow_preview(fn):
     "Method decorator for running action callbacks for in allowed tag preview context"
     def wrapper(self, view):
         if not view.settings().get('is_widget') and emmet.get_settings('tag_preview'):
-            size = emmet.get_settings('tag_preview_size_limit', 0)
-            if not size or view.size() <= size:
-                fn(self, view)
+            fn(self, view)
     return wrapper
 
 
+def schedule_preview(view: sublime.View):
+    """
+    Schedules tag preview update for current caret location on async thread.
+    Scheduled job supersedes the previous one: if it’s still running,
+    it stops document scanning
+    """
+    job = next(job_ids)
+    view_state.get_view(view, True).tag_preview_job = job
+    # Create buffer state on main thread: preview job only updates existing one
+    view_state.get_buffer(view, True)
+    sublime.set_timeout_async(lambda: handle_selection_change(view, job), 0)
+
+
+def is_current_job(view: sublime.View, job: int) -> bool:
+    "Check if given tag preview job is the last scheduled one for view"
+    state = view_state.get_view(view)
+    return state is not None and state.tag_preview_job == job
+
+
+def in_close_tag(view: sublime.View, pt: int) -> bool:
+    "Fast check if given location may be inside closing tag"
+    text = view.substr(sublime.Region(max(0, pt - max_close_tag_len), pt + 2))
+    ix = min(max_close_tag_len, pt)
+    return '</' in text[max(0, ix - 1):ix + 2] \
+        or re_close_tag_before.search(text, 0, ix) is not None
+
+
 def has_preview(view: sublime.View):
-    buffer_id = view.buffer_id()
-    if buffer_id in previews_by_buffer:
-        return previews_by_buffer[buffer_id][1]
+    state = view_state.get_buffer(view)
+    if state and state.tag_preview:
+        return state.tag_preview[1]
     return False
 
 
-def handle_selection_change(view: sublime.View):
+def handle_selection_change(view: sublime.View, job: int=None):
+    if job is not None and not is_current_job(view, job):
+        return
+
     caret = get_caret(view)
     syntax_name = syntax.from_pos(view, caret)
-    buffer_id = view.buffer_id()
+    state = view_state.get_buffer(view)
+
+    if syntax.is_html(syntax_name) and not syntax.is_jsx(syntax_name) and in_close_tag(view, caret):
+        change_count = view.change_count()
+        deadline = perf_counter() + emmet.get_settings('tag_preview_timeout', 100) / 1000
+        should_stop = lambda: perf_counter() > deadline or \
+            (job is not None and not is_current_job(view, job))
+        ctx = emmet.get_local_tag_context(view, caret, syntax.is_xml(syntax_name), should_stop)
+
+        if (job is not None and not is_current_job(view, job)) or view.change_count() != change_count:
+            # Superseded by newer caret move or edit, keep preview as is
+            # until newer job updates it
+            return
 
-    if syntax.is_html(syntax_name) and not syntax.is_jsx(syntax_name):
-        ctx = emmet.get_tag_context(view, caret, syntax.is_xml(syntax_name))
         if ctx and 'close' in ctx and \
             ctx['attributes'] and \
             ctx['close'].contains(caret) and \
@@ -107,22 +151,23 @@ def handle_selection_change(view: sublime.View):
 
             # Do not display preview if user forcibly hides it with Esc key
             # for current location
-            if buffer_id in previews_by_buffer:
-                pt = previews_by_buffer[buffer_id][0]
+            if state and state.tag_preview:
+                pt = state.tag_preview[0]
                 if pt == pos:
                     return
 
             preview = create_tag_preview(ctx)
             if len(preview) > max_preview_len:
                 preview = '%s...' % preview[0:max_preview_len]
-            show_tag_preview(view, pos, preview, ctx['open'].a)
-            previews_by_buffer[buffer_id] = (pos, True)
-            track_preview()
+            if state and view.is_valid():
+                show_tag_preview(view, pos, preview, ctx['open'].a)
+                state.tag_preview = (pos, True)
+                track_preview()
             return
 
     hide_tag_preview(view)
-    if buffer_id in previews_by_buffer:
-        del previews_by_buffer[buffer_id]
+    if state:
+        state.tag_preview = None
 
 
 def track_preview():
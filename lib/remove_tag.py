@@ -1,5 +1,5 @@
 import sublime
-from .utils import narrow_to_non_space
+from .utils import narrow_to_non_space, BufferReader
 
 
 def remove_tag(view: sublime.View, edit: sublime.Edit, tag: dict):
@@ -33,9 +33,6 @@ def get_line_indent(view: sublime.View, line: sublime.Region) -> str:
     "Returns indentation for given line or line found from given character location"
     if isinstance(line, int):
         line = view.line(line)
-    pos = line.begin()
-    end = line.end()
-    while pos < end and view.substr(pos).isspace():
-        pos += 1
-
-    return view.substr(sublime.Region(line.begin(), pos))
+    reader = BufferReader(view)
+    pos = reader.scan_forward(line.begin(), line.end(), str.isspace)
+    return reader.substr(line.begin(), pos)
@@ -1,9 +1,20 @@
+import re
 import sublime
 from . import emmet_sublime as emmet
 from . import syntax
+from .context import get_embedded_stylesheet
 from .utils import get_content
+from . import view_state
 
-models_for_buffer = {}
+__doc__ = """
+Select Item action. Computed model of the current tag or CSS rule is kept
+for buffer revision it was created for and is shifted through text changes
+which don’t affect its structure. Model of the next (or previous) item
+is prefetched on async thread
+"""
+
+re_token_text = re.compile(r'[^\s"\'<>=/,;:{}()\[\]]*$')
+"Inserted text which can’t change structure of edited token"
 
 
 def run_action(view: sublime.View, previous=False):
@@ -16,11 +27,11 @@ def run_action(view: sublime.View, previous=False):
 
 def select_item(view: sublime.View, sel: sublime.Region, is_css=False, is_previous=False):
     "Selects next/previous item for CSS source"
-    buffer_id = view.buffer_id()
+    state = view_state.get_buffer(view, True)
     pos = sel.begin()
 
     # Check if we are still in calculated model
-    model = models_for_buffer.get(buffer_id)
+    model = get_model(view, state)
     if model:
         region = find_region(sel, model.ranges, is_previous)
         if region:
@@ -30,17 +41,125 @@ def select_item(view: sublime.View, sel: sublime.Region, is_css=False, is_previo
         # Out of available selection range, move to next tag
         pos = model.start if is_previous else model.end
 
-    # Calculate new model from current editor content
-    content = get_content(view)
-    model = emmet.select_item(content, pos, is_css, is_previous)
+    model = get_prefetched(view, state, pos, is_css, is_previous) or \
+        create_model(view, pos, is_css, is_previous)
     if model:
-        models_for_buffer[buffer_id] = model
+        state.select_item_model = model
+        state.select_item_revision = view.change_count()
+        prefetch(view, model, is_css, is_previous)
         region = find_region(sel, model.ranges, is_previous)
         if region:
             select(view, region)
             return
 
 
+def create_model(view: sublime.View, pos: int, is_css=False, is_previous=False):
+    "Calculates Select Item model for given location from current editor content"
+    # For stylesheets embedded into other documents, parse stylesheet contents only
+    inner_region = get_embedded_stylesheet(view, pos) if is_css else None
+    if inner_region:
+        offset = inner_region.begin()
+        content = view.substr(inner_region)
+    else:
+        offset = 0
+        content = get_content(view)
+
+    model = emmet.select_item(content, pos - offset, is_css, is_previous)
+    if model and offset:
+        shift_model(model, offset)
+    return model
+
+
+def get_model(view: sublime.View, state: view_state.BufferState):
+    "Returns stored Select Item model, if it’s valid for current buffer revision"
+    if state.select_item_model and state.select_item_revision == view.change_count():
+        return state.select_item_model
+    return None
+
+
+def prefetch(view: sublime.View, model, is_css=False, is_previous=False):
+    "Calculates model of the item next to given one on async thread"
+    pos = model.start if is_previous else model.end
+    change_count = view.change_count()
+
+    def run():
+        state = view_state.get_buffer(view)
+        if state and view.is_valid() and view.change_count() == change_count:
+            next_model = create_model(view, pos, is_css, is_previous)
+            state.select_item_prefetch = (change_count, pos, is_css, is_previous, next_model)
+
+    sublime.set_timeout_async(run, 0)
+
+
+def get_prefetched(view: sublime.View, state: view_state.BufferState, pos: int,
+                   is_css=False, is_previous=False):
+    "Returns prefetched model for given location, if available"
+    key = (view.change_count(), pos, is_css, is_previous)
+    prefetched = state.select_item_prefetch
+    if prefetched and prefetched[:4] == key:
+        state.select_item_prefetch = None
+        return prefetched[4]
+    return None
+
+
+def shift_model(model, offset: int):
+    "Shifts locations of given Select Item model by given offset"
+    model.start += offset
+    model.end += offset
+    model.ranges = [sublime.Region(r.a + offset, r.b + offset) for r in model.ranges]
+
+
+def apply_change(view: sublime.View, model, begin: int, end: int, text: str) -> bool:
+    """
+    Updates locations of given Select Item model after `begin:end` region
+    was replaced with `text` in view. Returns `False` if edit may change
+    structure of model and it must be re-calculated
+    """
+    delta = len(text) - (end - begin)
+
+    # Edits outside of model must be separated from it by some delimiter:
+    # e.g. CSS selector may be extended with word typed after whitespace
+    if begin > model.end:
+        # Edit after model
+        return bool(view.substr(sublime.Region(model.end, begin)).strip())
+
+    if end < model.start:
+        # Edit before model
+        gap = view.substr(sublime.Region(begin + len(text), model.start + delta))
+        if gap.strip():
+            shift_model(model, delta)
+            return True
+        return False
+
+    if begin != end or begin <= model.start or begin >= model.end \
+        or not re_token_text.match(text):
+        # Removed contents inside model is unknown, as well as inserted
+        # text which may split token or close its quotes
+        return False
+
+    # Text must be inserted strictly inside innermost token, e.g. not at token
+    # boundary or in whitespace between tokens, where it may create new token
+    containing = [r for r in model.ranges if r.begin() <= begin <= r.end()]
+    if not containing or any(begin in (r.begin(), r.end()) for r in containing):
+        return False
+
+    token = min(containing, key=lambda r: r.size())
+    if any(r != token and token.contains(r) for r in model.ranges):
+        return False
+
+    # Text inserted into token: extend ranges which contain it
+    model.end += delta
+    ranges = []
+    for r in model.ranges:
+        if begin < r.begin():
+            r = sublime.Region(r.a + delta, r.b + delta)
+        elif begin < r.end():
+            r = sublime.Region(r.begin(), r.end() + delta)
+        ranges.append(r)
+    model.ranges = ranges
+    return True
+
+
 def find_region(sel, regions, reverse=False):
     if reverse:
         regions = regions[:]
@@ -73,6 +192,43 @@ def select(view: sublime.View, region: sublime.Region):
 
 def reset_model(view: sublime.View):
     "Resets stores model for given view"
-    buffer_id = view.buffer_id()
-    if buffer_id in models_for_buffer:
-        del models_for_buffer[buffer_id]
+    state = view_state.get_buffer(view)
+    if state:
+        state.select_item_model = None
+
+
+def handle_text_change(view: sublime.View, changes: list):
+    "Updates stored Select Item model after given text changes of view’s buffer"
+    state = view_state.get_buffer(view)
+    model = state and state.select_item_model
+    if not model:
+        return
+
+    # Only a single change can be checked against current buffer contents
+    c = changes[0]
+    if len(changes) == 1 and state.select_item_revision == c.a.change_count and \
+        apply_change(view, model, c.a.pt, c.b.pt, c.str):
+        state.select_item_revision = view.change_count()
+        state.select_item_selection = get_selection(view)
+    else:
+        state.select_item_model = None
+
+
+def handle_command(view: sublime.View, command_name: str):
+    """
+    Resets stored model after text command which moved caret outside
+    of Select Item flow. Model is kept if selection is still inside it or
+    if selection wasn’t moved since the last edit the model was updated with
+    """
+    state = view_state.get_buffer(view)
+    model = state and state.select_item_model
+    if model and command_name != 'emmet_select_item':
+        in_model = all(model.start <= s.begin() and s.end() <= model.end for s in view.sel())
+        if not in_model and get_selection(view) != state.select_item_selection:
+            state.select_item_model = None
+        state.select_item_selection = None
+
+
+def get_selection(view: sublime.View) -> list:
+    "Returns current selection of given view as list of `(a, b)` tuples"
+    return [(s.a, s.b) for s in view.sel()]
@@ -0,0 +1,137 @@
+import os
+import os.path
+import json
+import pickle
+import hashlib
+import sublime
+from .. import emmet
+from ..emmet.snippets import stylesheet_snippets
+
+__doc__ = """
+Persistent storage for internal Emmet data (parsed snippet registries).
+Contents of cache are stored in Sublime Text cache folder and are valid for
+current py-emmet version, plugin version and user `config` setting only
+"""
+
+CACHE_FILE = 'emmet-cache.pickle'
+
+# Save cache a bit later to collect as much as possible data in a single write
+SAVE_DELAY = 1000
+
+package_name = __package__.split('.')[0]
+_emmet_version = None
+
+
+class PersistentCache(dict):
+    """
+    Cache for storing internal Emmet data which is lazily restored from disk
+    on first access and is saved back when Emmet adds new entries into it
+    """
+    def __init__(self, user_config: dict = None):
+        super().__init__()
+        self.user_config = user_config or {}
+        self.loaded = False
+        self.scheduled = False
+
+    def get(self, key, default=None):
+        self.load()
+        return super().get(key, default)
+
+    def __getitem__(self, key):
+        self.load()
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.load()
+        return super().__contains__(key)
+
+    def __setitem__(self, key, value):
+        self.load()
+        super().__setitem__(key, value)
+        self.schedule_save()
+
+    def load(self):
+        "Restores cache contents from disk, if it’s valid for current environment"
+        if self.loaded:
+            return
+
+        self.loaded = True
+        data = read_cache(cache_key(self.user_config))
+        if data:
+            self.update(data)
+
+    def schedule_save(self):
+        if not self.scheduled:
+            self.scheduled = True
+            sublime.set_timeout_async(self.save, SAVE_DELAY)
+
+    def save(self):
+        self.scheduled = False
+        write_cache(cache_key(self.user_config), dict(self))
+
+
+def cache_key(user_config: dict) -> str:
+    "Returns key of persistent cache for given user config"
+    payload = json.dumps({
+        'emmet': emmet_version(),
+        'plugin': plugin_version(),
+        'config': user_config
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf8')).hexdigest()
+
+
+def emmet_version() -> str:
+    """
+    Returns version identifier of bundled py-emmet module.
+    Since py-emmet doesn’t expose its version, a fingerprint of bundled
+    stylesheet snippets is used as well
+    """
+    global _emmet_version
+
+    if _emmet_version is None:
+        fingerprint = json.dumps(stylesheet_snippets, sort_keys=True)
+        version = getattr(emmet, '__version__', '')
+        _emmet_version = '%s:%s' % (version, hashlib.sha1(fingerprint.encode('utf8')).hexdigest())
+
+    return _emmet_version
+
+
+def plugin_version() -> str:
+    "Returns current plugin version"
+    try:
+        return sublime.load_resource('Packages/%s/VERSION' % package_name).strip()
+    except:
+        return ''
+
+
+def get_cache_file() -> str:
+    "Returns path to persistent cache file"
+    return os.path.join(sublime.cache_path(), package_name, CACHE_FILE)
+
+
+def read_cache(key: str) -> dict:
+    "Reads cache contents stored with given key, if any"
+    try:
+        with open(get_cache_file(), 'rb') as fp:
+            payload = pickle.load(fp)
+        if isinstance(payload, dict) and payload.get('key') == key:
+            return payload.get('data')
+    except:
+        # Cache file is either missing, corrupted or created by incompatible
+        # version of plugin: it will be overwritten on next save
+        pass
+
+    return None
+
+
+def write_cache(key: str, data: dict):
+    "Stores given cache data with given key"
+    file_path = get_cache_file()
+    tmp_path = '%s.tmp' % file_path
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(tmp_path, 'wb') as fp:
+            pickle.dump({'key': key, 'data': data}, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, file_path)
+    except:
+        print('Emmet: unable to save snippet cache to %s' % file_path)
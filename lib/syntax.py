@@ -8,10 +8,15 @@ stylesheet_syntaxes = ['css', 'scss', 'sass', 'less', 'sss', 'stylus', 'postcss'
 xml_syntaxes = ['xml', 'xsl', 'jsx']
 html_syntaxes = ['html']
 
+max_cached_scopes = 512
+
 # NB: avoid circular reference for `emmet_sublime` module,
 # create own settings instance
 settings = None
 
+_scopes = {}
+"Settings-dependent data about scope names, see `get_scope_memo()`"
+
 def get_settings(key: str, default=None):
     "Returns value of given Emmet setting"
     global settings
@@ -51,6 +56,13 @@ def doc_syntax(view: sublime.View) -> str:
 
 def from_pos(view: sublime.View, pt: int):
     "Returns Emmet syntax for given location in view"
+    memo = get_scope_memo(view, pt)
+    if 'syntax' not in memo:
+        memo['syntax'] = detect_syntax(view, pt)
+    return memo['syntax']
+
+
+def detect_syntax(view: sublime.View, pt: int):
     scopes = get_settings('syntax_scopes', {})
     if scopes:
         for name, sel in scopes.items():
@@ -102,6 +114,26 @@ def in_activation_scope(view: sublime.View, pt: int):
     Check if given location in view can be used for abbreviation marker activation.
     Note that this method implies that caret is in Emmet-supported syntax
     """
+    memo = get_scope_memo(view, pt)
+    if 'activation' not in memo:
+        memo['activation'] = activation_scope(view, pt)
+
+    allowed = memo['activation']
+    if allowed is None:
+        # Handle edge case for HTML syntax:
+        # <div>a|</div>
+        # in this example, ST returns `punctuation.definition.tag.begin.html`
+        # scope, even if caret is actually not in tag. Add some custom checks here
+        return view.substr(pt) == '<'
+
+    return allowed
+
+
+def activation_scope(view: sublime.View, pt: int):
+    """
+    Check if scope at given location allows abbreviation marker activation.
+    Returns `None` if it depends on character at given location
+    """
     ignore = get_settings('ignore_scopes', [])
     if matches_selector(view, pt, ignore):
         return False
@@ -110,16 +142,31 @@ def in_activation_scope(view: sublime.View, pt: int):
     if matches_selector(view, pt, scopes):
         return True
 
-    # Handle edge case for HTML syntax:
-    # <div>a|</div>
-    # in this example, ST returns `punctuation.definition.tag.begin.html`
-    # scope, even if caret is actually not in tag. Add some custom checks here
-    if view.match_selector(pt, '(text.html | text.xml) meta.tag punctuation.definition.tag.begin') and view.substr(pt) == '<':
-        return True
+    if view.match_selector(pt, '(text.html | text.xml) meta.tag punctuation.definition.tag.begin'):
+        return None
 
     return False
 
 
+def get_scope_memo(view: sublime.View, pt: int) -> dict:
+    """
+    Returns storage for data which depends on scope name at given location
+    and Emmet settings only
+    """
+    scope = view.scope_name(pt)
+    memo = _scopes.get(scope)
+    if memo is None:
+        if len(_scopes) >= max_cached_scopes:
+            _scopes.clear()
+        memo = _scopes[scope] = {}
+    return memo
+
+
+def reset_scope_memo():
+    "Resets scope data after settings change"
+    _scopes.clear()
+
+
 def matches_selector(view: sublime.View, pt: int, selectors: list):
     "Check if given location in view one of the given selectors"
     for sel in selectors:
@@ -1,5 +1,4 @@
 import uuid
-import urllib
 import sublime
 from .config import get_settings
 
@@ -64,6 +63,9 @@ def get_user_agent():
 
 def _flush_queue():
     global scheduled, queue
+    import urllib.parse
+    import urllib.request
+
     scheduled = False
     if not queue:
         # Seems like plugin was reloaded, skip queue
@@ -1,6 +1,5 @@
 import re
 import os.path
-import urllib.request
 import sublime
 from ..emmet.html_matcher import AttributeToken
 from ..emmet.action_utils import CSSProperty
@@ -11,7 +10,7 @@ pairs = {
     '(': ')'
 }
 
-known_tags = [
+known_tags = frozenset((
 	'a', 'abbr', 'acronym', 'address', 'applet', 'area', 'article', 'aside', 'audio',
 	'b', 'base', 'basefont', 'bdi', 'bdo', 'bgsound', 'big', 'blink', 'blockquote', 'body', 'br', 'button',
 	'canvas', 'caption', 'center', 'cite', 'code', 'col', 'colgroup', 'command', 'content',
@@ -22,7 +21,7 @@ known_tags = [
 	'i', 'iframe', 'image', 'img', 'input', 'ins', 'isindex',
 	'kbd', 'keygen',
 	'label', 'legend', 'li', 'link', 'listing',
-	'main', 'main', 'map', 'mark', 'marquee', 'menu', 'menuitem', 'meta', 'meter', 'multicol',
+	'main', 'map', 'mark', 'marquee', 'menu', 'menuitem', 'meta', 'meter', 'multicol',
 	'nav', 'nextid', 'nobr', 'noembed', 'noframes', 'noscript',
 	'object', 'ol', 'optgroup', 'option', 'output',
 	'p', 'param', 'picture', 'plaintext', 'pre', 'progress',
@@ -30,7 +29,7 @@ known_tags = [
 	'rb', 'rp', 'rt', 'rtc', 'ruby',
 	's', 'samp', 'script', 'section', 'select', 'shadow', 'slot', 'small', 'source', 'spacer', 'span', 'strike', 'strong', 'style', 'sub', 'summary', 'sup',
 	'table', 'tbody', 'td', 'template', 'textarea', 'tfoot', 'th', 'thead', 'time', 'title', 'tr', 'track', 'tt', 'u', 'ul', 'var', 'video', 'wbr', 'xmp'
-]
+))
 
 pairs_end = {}
 for k, v in pairs.items():
@@ -40,22 +39,90 @@ for k, v in pairs.items():
 NON_SPACE_LEFT = 1
 NON_SPACE_RIGHT = 2
 
+READER_CHUNK_SIZE = 4096
+
+
+class BufferReader:
+    """
+    Reads contents of view in cached chunks. Should be used instead of
+    `view.substr()` for character-by-character reading: each `view.substr()`
+    call is a relatively expensive call into Sublime Text API.
+    Reader must be discarded once view contents is modified
+    """
+    __slots__ = ('view', 'size', 'chunk_size', 'chunks')
+
+    def __init__(self, view: sublime.View, chunk_size=READER_CHUNK_SIZE):
+        self.view = view
+        self.size = view.size()
+        self.chunk_size = chunk_size
+        self.chunks = {}
+
+    def chunk(self, index: int) -> str:
+        "Returns text chunk with given index"
+        chunk = self.chunks.get(index)
+        if chunk is None:
+            start = index * self.chunk_size
+            chunk = self.chunks[index] = self._read(start, start + self.chunk_size)
+        return chunk
+
+    def char(self, pt: int) -> str:
+        "Returns character at given location. Like `view.substr()`, returns NUL char if location is out of bounds"
+        if 0 <= pt < self.size:
+            return self.chunk(pt // self.chunk_size)[pt % self.chunk_size]
+        return '\x00'
+
+    def substr(self, begin: int, end: int) -> str:
+        "Returns text in given range"
+        begin = max(0, begin)
+        end = min(self.size, end)
+        if begin >= end:
+            return ''
+
+        first = begin // self.chunk_size
+        last = (end - 1) // self.chunk_size
+        if last - first > 1:
+            # Large range: read it directly instead of filling cache
+            return self._read(begin, end)
+
+        offset = first * self.chunk_size
+        text = ''.join(self.chunk(i) for i in range(first, last + 1))
+        return text[begin - offset:end - offset]
+
+    def scan_forward(self, pos: int, end: int, match) -> int:
+        "Consumes characters from `pos` towards `end` while they match given function. Returns location of the first unmatched character"
+        end = min(end, self.size)
+        while pos < end and match(self.char(pos)):
+            pos += 1
+        return pos
+
+    def scan_backward(self, pos: int, begin: int, match) -> int:
+        "Consumes characters before `pos` towards `begin` while they match given function. Returns location right after the first unmatched character"
+        begin = max(begin, 0)
+        while pos > begin and match(self.char(pos - 1)):
+            pos -= 1
+        return pos
+
+    def search(self, pattern, pos: int, end: int = None) -> sublime.Region:
+        "Finds first match of given regular expression in given range"
+        if end is None:
+            end = self.size
+        m = pattern.search(self.substr(pos, end))
+        return sublime.Region(pos + m.start(), pos + m.end()) if m else None
+
+    def _read(self, begin: int, end: int) -> str:
+        return self.view.substr(sublime.Region(begin, min(end, self.size)))
+
 def narrow_to_non_space(view: sublime.View, region: sublime.Region, direction = NON_SPACE_LEFT | NON_SPACE_RIGHT) -> sublime.Region:
     "Returns copy of region which starts and ends at non-space character"
     begin = region.begin()
     end = region.end()
+    reader = BufferReader(view)
 
     if direction & NON_SPACE_LEFT:
-        while begin < end:
-            if not view.substr(begin).isspace():
-                break
-            begin += 1
+        begin = reader.scan_forward(begin, end, str.isspace)
 
     if (direction & NON_SPACE_RIGHT):
-        while end > begin:
-            if not view.substr(end - 1).isspace():
-                break
-            end -= 1
+        end = reader.scan_backward(end, begin, str.isspace)
 
     return sublime.Region(begin, end)
 
@@ -121,6 +188,7 @@ def is_url(file_path: str):
 def read_file(file_path: str, size=-1):
     "Reads content of given file. If `size` if given, reads up to `size` bytes"
     if is_url(file_path):
+        import urllib.request
         with urllib.request.urlopen(file_path, timeout=5) as req:
             return req.read(size)
 
@@ -0,0 +1,266 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import sublime
+
+__doc__ = """
+Registry of plugin state attached to views and buffers. Each registry is
+bounded: least recently used records are evicted when limit is reached.
+State of closed views and buffers is removed in `dispose()`
+"""
+
+MAX_VIEWS = 256
+MAX_BUFFERS = 256
+
+
+class ViewState:
+    "Plugin state for a single view"
+    __slots__ = ('tracker', 'stored_tracker', 'last_pos', 'forced_indicator',
+                 'phantom_preview', 'has_popup_preview', 'contexts', 'contexts_key',
+                 'queries', 'queries_key', 'tag_preview_job', 'wrap_preview')
+
+    def __init__(self):
+        self.tracker = None
+        "Currently active abbreviation tracker"
+
+        self.stored_tracker = None
+        "Last tracker which can be restored when user continues editing"
+
+        self.last_pos = None
+        "Last known caret location"
+
+        self.forced_indicator = None
+        "Phantom set for forced abbreviation indicator"
+
+        self.phantom_preview = None
+        "Phantom set for stylesheet abbreviation preview"
+
+        self.has_popup_preview = False
+        "Markup abbreviation preview is currently displayed in popup"
+
+        self.contexts = {}
+        "Cached abbreviation activation contexts for locations in view"
+
+        self.contexts_key = None
+        "Buffer and settings revision of cached activation contexts"
+
+        self.queries = {}
+        "Cached answers for key binding context queries"
+
+        self.queries_key = None
+        "Buffer and settings revision, syntax and selection of cached query answers"
+
+        self.tag_preview_job = None
+        "ID of the last scheduled tag preview job"
+
+        self.wrap_preview = None
+        "Phantom set for Wrap with Abbreviation preview"
+
+
+class BufferState:
+    "Plugin state for a single buffer, shared between view clones"
+    __slots__ = ('tag_preview', 'tag_phantoms', 'select_item_model', 'select_item_revision',
+                 'select_item_selection', 'select_item_prefetch', 'balance_chains', 'balance_key',
+                 'checkpoints', 'region_indexes')
+
+    def __init__(self):
+        self.tag_preview = None
+        "Location of displayed tag preview and its visibility, as `(pt, visible)` tuple"
+
+        self.tag_phantoms = None
+        "Phantom set for tag preview"
+
+        self.select_item_model = None
+        "Last computed Select Item model"
+
+        self.select_item_revision = None
+        "Buffer revision of Select Item model"
+
+        self.select_item_selection = None
+        "Selection right after text change applied to Select Item model, as list of `(a, b)` tuples"
+
+        self.select_item_prefetch = None
+        "Model of the next Select Item as `(change_count, pos, is_css, is_previous, model)` tuple"
+
+        self.balance_chains = {}
+        "Cached regions for Balance action, keyed by location"
+
+        self.balance_key = None
+        "Buffer revision, syntax and direction of cached balancing regions"
+
+        self.checkpoints = {}
+        "Saved parser states, see `get_checkpoints()`"
+
+        self.region_indexes = {}
+        "Sorted regions of buffer, see `get_region_index()`"
+
+
+class Checkpoints:
+    """
+    Parser states saved at document offsets for a single buffer revision.
+    A state saved at offset must depend on buffer contents before that
+    offset only, so it remains valid after any edit past it
+    """
+    __slots__ = ('change_count', 'offsets', 'states')
+
+    def __init__(self, change_count: int):
+        self.change_count = change_count
+        self.offsets = []
+        self.states = []
+
+    def find(self, pos: int) -> tuple:
+        "Returns `(offset, state)` of the nearest checkpoint at or before given location"
+        ix = bisect_right(self.offsets, pos) - 1
+        if ix >= 0:
+            return self.offsets[ix], self.states[ix]
+        return 0, None
+
+    def add(self, offset: int, state):
+        "Saves parser state at given offset"
+        ix = bisect_left(self.offsets, offset)
+        if ix < len(self.offsets) and self.offsets[ix] == offset:
+            self.states[ix] = state
+        else:
+            self.offsets.insert(ix, offset)
+            self.states.insert(ix, state)
+
+    def invalidate(self, pos: int):
+        "Removes checkpoints which may be affected by edit at given location"
+        ix = bisect_left(self.offsets, pos)
+        del self.offsets[ix:]
+        del self.states[ix:]
+
+
+class StateRegistry:
+    "LRU-bounded storage of state records"
+    __slots__ = ('factory', 'limit', 'items')
+
+    def __init__(self, factory, limit: int):
+        self.factory = factory
+        self.limit = limit
+        self.items = OrderedDict()
+
+    def get(self, key: int, create=False):
+        "Returns state record for given key. If `create` is True, creates missing record"
+        item = self.items.get(key)
+        if item is not None:
+            self.items.move_to_end(key)
+        elif create:
+            item = self.items[key] = self.factory()
+            while len(self.items) > self.limit:
+                self.items.popitem(last=False)
+
+        return item
+
+    def pop(self, key: int):
+        "Removes state record for given key"
+        return self.items.pop(key, None)
+
+    def clear(self):
+        self.items.clear()
+
+
+views = StateRegistry(ViewState, MAX_VIEWS)
+buffers = StateRegistry(BufferState, MAX_BUFFERS)
+
+
+def get_view(view: sublime.View, create=False) -> ViewState:
+    "Returns state of given view"
+    return views.get(view.id(), create)
+
+
+def get_buffer(view: sublime.View, create=False) -> BufferState:
+    "Returns state of buffer of given view"
+    return buffers.get(view.buffer_id(), create)
+
+
+class RegionIndex:
+    """
+    Sorted list of non-overlapping regions for a single buffer revision
+    with binary search lookup
+    """
+    __slots__ = ('change_count', 'begins', 'regions')
+
+    def __init__(self, change_count: int, regions: list):
+        self.change_count = change_count
+        self.regions = regions
+        self.begins = [r.begin() for r in regions]
+
+    def find(self, pos: int) -> sublime.Region:
+        "Returns the first region which contains given location, if any"
+        ix = bisect_right(self.begins, pos) - 1
+        # NB: adjacent region may end at given location as well
+        if ix > 0 and self.regions[ix - 1].contains(pos):
+            return self.regions[ix - 1]
+        if ix >= 0 and self.regions[ix].contains(pos):
+            return self.regions[ix]
+        return None
+
+
+def get_checkpoints(view: sublime.View, name: str) -> Checkpoints:
+    "Returns named parser checkpoints for current revision of view’s buffer"
+    # NB: may be invoked on async thread, do not create state for closed view
+    state = get_buffer(view, view.is_valid())
+    change_count = view.change_count()
+    if state is None:
+        return Checkpoints(change_count)
+
+    checkpoints = state.checkpoints.get(name)
+    if checkpoints is None or checkpoints.change_count != change_count:
+        checkpoints = state.checkpoints[name] = Checkpoints(change_count)
+    return checkpoints
+
+
+def get_region_index(view: sublime.View, selector: str, build=None) -> RegionIndex:
+    """
+    Returns index of regions matching given selector for current revision
+    of view’s buffer. If `build` function is given, it’s used to get sorted
+    list of regions instead of `view.find_by_selector()`
+    """
+    state = get_buffer(view, view.is_valid())
+    change_count = view.change_count()
+    if state is None:
+        return RegionIndex(change_count, build(view) if build else view.find_by_selector(selector))
+
+    index = state.region_indexes.get(selector)
+    if index is None or index.change_count != change_count:
+        regions = build(view) if build else view.find_by_selector(selector)
+        index = state.region_indexes[selector] = RegionIndex(change_count, regions)
+    return index
+
+
+def handle_change(view: sublime.View, changes: list):
+    """
+    Updates buffer state of given view after its contents was modified
+    with given list of `sublime.TextChange`
+    """
+    state = get_buffer(view)
+    if state and changes:
+        # Checkpoints can be kept only if they are made for buffer revision
+        # these changes were applied to
+        base_change_count = changes[0].a.change_count
+        change_count = view.change_count()
+        pos = min(c.a.pt for c in changes)
+        for name, checkpoints in list(state.checkpoints.items()):
+            if checkpoints.change_count == base_change_count:
+                checkpoints.invalidate(pos)
+                checkpoints.change_count = change_count
+            else:
+                del state.checkpoints[name]
+
+
+def dispose(view: sublime.View):
+    """
+    Removes state of given closed view. States of buffers which have no
+    open views left are removed as well
+    """
+    views.pop(view.id())
+    open_buffers = set(v.buffer_id() for window in sublime.windows() for v in window.views())
+    for buffer_id in list(buffers.items):
+        if buffer_id not in open_buffers:
+            buffers.pop(buffer_id)
+
+
+def clear():
+    "Removes state of all views and buffers"
+    views.clear()
+    buffers.clear()
@@ -0,0 +1,73 @@
+import time
+import sublime
+from ..emmet import extract
+from . import syntax
+from .config import get_config, get_preview_config
+from .emmet_sublime import expand
+from .utils import get_caret
+
+__doc__ = """
+Background warm-up of Emmet internals: settings, configs and snippet caches
+for syntaxes of opened views are prepared on async thread so that the first
+abbreviation typed by user is expanded as fast as the next ones
+"""
+
+sample_abbreviations = {
+    'markup': 'ul>li.item*2',
+    'stylesheet': 'p10'
+}
+
+
+def schedule():
+    "Schedules warm-up on async thread"
+    sublime.set_timeout_async(run, 0)
+
+
+def run():
+    "Warms up Emmet for syntaxes of all opened views"
+    start = time.perf_counter()
+    warmed = set()
+
+    for window in sublime.windows():
+        for view in window.views():
+            if view.settings().get('is_widget'):
+                continue
+
+            pos = get_caret(view)
+            syntax_name = syntax.from_pos(view, pos)
+            if syntax_name and syntax_name not in warmed and syntax.is_supported(syntax_name):
+                warmed.add(syntax_name)
+                warm_up_syntax(view, pos, syntax_name)
+
+    if warmed:
+        print('Emmet: warm-up for %d syntaxes finished in %s' % (len(warmed), format_time(time.perf_counter() - start)))
+
+
+def warm_up_syntax(view: sublime.View, pos: int, syntax_name: str):
+    "Prepares Emmet data for given syntax and reports first expansion latency"
+    abbr = sample_abbreviations[syntax.get_type(syntax_name)]
+
+    try:
+        cold = measure(view, pos, abbr)
+        warm = measure(view, pos, abbr)
+        print('Emmet: first expansion in "%s": %s before warm-up, %s after' % \
+            (syntax_name, format_time(cold), format_time(warm)))
+    except:
+        print('Emmet: unable to warm up "%s" syntax' % syntax_name)
+
+
+def measure(view: sublime.View, pos: int, abbr: str) -> float:
+    "Runs the same steps as abbreviation tracker does and returns elapsed time"
+    start = time.perf_counter()
+    config = get_config(view, pos)
+    extract(abbr, len(abbr), {
+        'type': config.type,
+        'lookAhead': config.type != 'stylesheet'
+    })
+    expand(abbr, get_preview_config(config))
+    expand(abbr, config)
+    return time.perf_counter() - start
+
+
+def format_time(value: float) -> str:
+    return '%.2fms' % (value * 1000)
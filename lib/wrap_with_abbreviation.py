@@ -1,16 +1,30 @@
 import re
+import html
 import sublime
 import sublime_plugin
 from ..emmet.config import Config
 from ..emmet.abbreviation import parse as markup_parse
 from ..emmet.css_abbreviation import parse as stylesheet_parse
-from .config import get_config
+from .abbreviation import format_snippet
+from .config import get_config, get_preview_config, get_user_css
 from .context import get_html_context
 from . import emmet_sublime as emmet
+from . import html_highlight
 from . import utils
 from . import syntax
+from . import view_state
 
 re_indent = re.compile(r'^\s+')
+phantom_key = 'emmet_wrap_preview'
+
+max_preview_lines = 3
+"Max amount of wrapped text lines displayed in preview"
+
+max_preview_line_len = 80
+"Max length of wrapped text line displayed in preview"
+
+_parsed = None
+"Last parsed wrap abbreviation as `(key, tokens)` tuple"
 
 class WrapAbbreviationInputHandler(sublime_plugin.TextInputHandler):
     def __init__(self, view: sublime.View, wrap_entries: list, initial_abbr=None, preview=False):
@@ -18,6 +32,7 @@ class WrapAbbreviationInputHandler(sublime_plugin.TextInputHandler):
         self.wrap_entries = wrap_entries
         self.instant_preview = preview
         self.initial_abbr = initial_abbr
+        self.preview_shown = False
 
     def placeholder(self):
         return 'Enter abbreviation'
@@ -30,6 +45,8 @@ class WrapAbbreviationInputHandler(sublime_plugin.TextInputHandler):
             config = self.wrap_entries[0][1] if self.wrap_entries else None
             if config and config.type == 'stylesheet':
                 stylesheet_parse(text, config)
+            elif config:
+                parse_abbreviation(text.strip(), config)
             else:
                 markup_parse(text, config)
             return True
@@ -37,31 +54,37 @@ class WrapAbbreviationInputHandler(sublime_plugin.TextInputHandler):
             return False
 
     def cancel(self):
-        undo_preview(self.view)
+        hide_preview(self.view)
 
     def confirm(self, text: str):
-        undo_preview(self.view)
+        hide_preview(self.view)
 
     def preview(self, text: str):
         abbr = text.strip()
         snippet = None
-
-        undo_preview(self.view)
+        phantoms = []
 
         if abbr:
-            try:
-                preview_items = []
-                for region, config in self.wrap_entries:
-                    result = emmet.expand(abbr, config)
-                    if self.instant_preview:
-                        preview_items.append((region.begin(), region.end(), result))
-
-                if preview_items:
-                    self.view.run_command('emmet_wrap_with_abbreviation_preview', {
-                        'items': preview_items
-                    })
-            except:
+            if not self.validate(abbr):
                 snippet = '<div class="error">Invalid abbreviation</div>'
+            elif self.instant_preview:
+                try:
+                    # Display preview for visible regions only
+                    visible = self.view.visible_region()
+                    for i, (region, config) in enumerate(self.wrap_entries):
+                        if i == 0 or visible.intersects(region):
+                            result = expand(abbr, get_wrap_preview_config(config))
+                            phantoms.append(sublime.Phantom(sublime.Region(region.begin()),
+                                preview_phantom_html(result, config), sublime.LAYOUT_BLOCK))
+                except:
+                    snippet = '<div class="error">Invalid abbreviation</div>'
+                    phantoms = []
+
+        update_preview(self.view, phantoms)
+        if phantoms and not self.preview_shown:
+            # Reveal preview once, let user scroll view while typing
+            self.preview_shown = True
+            self.view.show(phantoms[0].region.begin())
 
         if snippet:
             return sublime.Html(popup_content(snippet))
@@ -133,10 +156,77 @@ def get_wrap_region(view: sublime.View, sel: sublime.Region, config: Config) ->
     return utils.narrow_to_non_space(view, sel, utils.NON_SPACE_LEFT)
 
 
-def undo_preview(view: sublime.View):
-    last_command = view.command_history(0, True)[0]
-    if last_command == 'emmet_wrap_with_abbreviation_preview':
-        view.run_command('undo')
+def parse_abbreviation(abbr: str, config: Config):
+    """
+    Parses given markup abbreviation for wrapping. Parsed abbreviation is reused
+    while user enters the same abbreviation in input panel and for every
+    wrapped region
+    """
+    global _parsed
+    key = (abbr, bool(config.options.get('jsx.enabled')))
+    if _parsed is None or _parsed[0] != key:
+        _parsed = (key, emmet.parse_markup(abbr, config))
+    return _parsed[1]
+
+
+def expand(abbr: str, config: Config) -> str:
+    "Expands given wrap abbreviation with config of wrapped region"
+    if config.type == 'stylesheet':
+        return emmet.expand(abbr, config)
+    return emmet.expand_parsed(parse_abbreviation(abbr, config), config)
+
+
+def update_preview(view: sublime.View, phantoms: list):
+    "Displays given wrap preview phantoms in view"
+    state = view_state.get_view(view, True)
+    if state.wrap_preview is None:
+        state.wrap_preview = sublime.PhantomSet(view, phantom_key)
+    state.wrap_preview.update(phantoms)
+
+
+def hide_preview(view: sublime.View):
+    "Hides wrap preview in given view"
+    state = view_state.get_view(view)
+    if state and state.wrap_preview is not None:
+        state.wrap_preview = None
+        view.erase_phantoms(phantom_key)
+
+
+def get_wrap_preview_config(config: Config) -> Config:
+    """
+    Returns config for wrap preview: wrapped text is collapsed to a few short
+    lines so that preview cost doesn’t depend on wrapped text size
+    """
+    lines = (config.user_config or {}).get('text') or []
+    # Preview is not inserted as snippet, unescape wrapped text
+    text = [line[0:max_preview_line_len].replace('\\$', '$') for line in lines[0:max_preview_lines]]
+    if len(lines) > max_preview_lines or any(len(line) > max_preview_line_len for line in lines[0:max_preview_lines]):
+        text.append('...')
+
+    preview_config = get_preview_config(config)
+    preview_config.syntax = config.syntax
+    preview_config.type = config.type
+    preview_config.user_config['text'] = text
+    return preview_config
+
+
+def preview_phantom_html(snippet: str, config: Config) -> str:
+    "Returns contents of wrap preview phantom for given expanded snippet"
+    if syntax.is_html(config.syntax):
+        snippet = html_highlight.highlight(snippet)
+    else:
+        snippet = html.escape(snippet, False)
+
+    return """
+    <body id="emmet-wrap-preview">
+        <style>
+            body { font-size: 0.8rem; }
+            %s
+            %s
+        </style>
+        <div class="markup-preview">%s</div>
+    </body>
+    """ % (html_highlight.styles(), get_user_css(), format_snippet(snippet))
 
 
 def get_wrap_config(view: sublime.View, pos: int) -> Config:
@@ -1,7 +1,11 @@
 import sys
+import time
+import importlib
 import sublime
 import sublime_plugin
 
+load_start = time.perf_counter()
+
 if int(sublime.version()) >= 3114:
 
     # Clear module cache to force reloading all modules of this package.
@@ -15,26 +19,40 @@ if int(sublime.version()) >= 3114:
         del sys.modules[module_name]
     prefix = None
 
-from .lib import emmet_sublime, abbreviation, balance, syntax, comment, \
-    convert_data_url as convert, go_to_edit_point as go_to, go_to_tag_pair as tag_pair, \
-    inc_dec_number as inc_dec, select_item, wrap_with_abbreviation as wrap
-from .lib.remove_tag import remove_tag
-from .lib.split_join_tag import split_join_tag
-from .lib.update_image_size import update_image_size
+# NB: import modules required by event listeners only. Modules of commands are
+# imported on first command invocation with `lib()` to reduce plugin load time
+from .lib import emmet_sublime, abbreviation, syntax, completions, view_state, go_to_tag_pair as tag_pair
 from .lib.utils import get_caret, narrow_to_non_space, replace_with_snippet, multicursor_replace_with_snippet
 from .lib.telemetry import track_action, check_telemetry
-from .lib.config import get_settings
+from .lib.config import get_settings, get_settings_revision
 
 
 last_wrap_abbreviation = None
 "Last abbreviation used for wrapping"
 
+load_time = time.perf_counter() - load_start
+"Time spent on plugin modules loading, in seconds"
+
 def plugin_unloaded():
     abbreviation.plugin_unloaded()
+    view_state.clear()
 
 
 def plugin_loaded():
+    print('Emmet: plugin loaded in %.2fms' % (load_time * 1000))
     check_telemetry()
+    if get_settings('warm_up', False):
+        lib('warm_up').schedule()
+
+
+def lib(name: str):
+    "Returns module with given name from `lib` package, imports it if required"
+    return importlib.import_module('%s.lib.%s' % (__package__, name))
+
+
+def loaded_lib(name: str):
+    "Returns module with given name from `lib` package only if it’s already imported"
+    return sys.modules.get('%s.lib.%s' % (__package__, name))
 
 
 def main_view(fn):
@@ -79,12 +97,19 @@ class EmmetExpandAbbreviation(sublime_plugin.TextCommand):
         doc_size = self.view.size()
         expanded = None
         cur_tracker = abbreviation.get_tracker(self.view)
+        abbreviation.stop_tracking(self.view, {'force': True})
 
+        # Cursors with the same abbreviation in the same context are expanded once
+        snippets = {}
+
+        # NB: since carets are processed from the end of document,
+        # current tracker location remains valid
         for sel in reversed(list(self.view.sel())):
-            trk = abbreviation.suggest_abbreviation_tracker(self.view, sel.end())
-            if trk:
-                abbreviation.expand_tracker(self.view, edit, trk)
-                expanded = trk.config.syntax
+            expansion = abbreviation.get_expansion(self.view, sel.end(), snippets, cur_tracker)
+            if expansion:
+                region, snippet, config = expansion
+                replace_with_snippet(self.view, edit, region, snippet)
+                expanded = config.syntax
 
                 # Update locations of existing regions
                 next_size = self.view.size()
@@ -97,7 +122,6 @@ class EmmetExpandAbbreviation(sublime_plugin.TextCommand):
                 sels += list(self.view.sel())
             else:
                 sels.append(sel)
-            abbreviation.stop_tracking(self.view, {'force': True})
 
         s = self.view.sel()
         s.clear()
@@ -151,6 +175,7 @@ class EmmetBalance(sublime_plugin.TextCommand):
             return
 
         direction = kw.get('direction', 'outward')
+        balance = lib('balance')
 
         if direction == 'inward':
             regions = balance.balance_inward(self.view, syntax_name)
@@ -168,6 +193,7 @@ class EmmetBalance(sublime_plugin.TextCommand):
 class EmmetToggleComment(sublime_plugin.TextCommand):
     def run(self, edit):
         view = self.view
+        comment = lib('comment')
         for s in view.sel():
             pt = s.begin()
             syntax_name = syntax.from_pos(view, pt)
@@ -206,6 +232,7 @@ class EmmetConvertDataUrl(sublime_plugin.TextCommand):
     def run(self, edit):
         caret = get_caret(self.view)
         syntax_name = syntax.from_pos(self.view, caret)
+        convert = lib('convert_data_url')
 
         if syntax.is_html(syntax_name):
             convert.convert_html(self.view, edit, caret)
@@ -255,6 +282,7 @@ class EmmetGoToEditPoint(sublime_plugin.TextCommand):
     def run(self, edit, previous=False):
         delta = -1 if previous else 1
         next_selections = []
+        go_to = lib('go_to_edit_point')
         for r in self.view.sel():
             pt = go_to.find_new_edit_point(self.view, r.begin() + delta, delta)
             if pt is not None:
@@ -277,7 +305,7 @@ class EmmetGoToTagPair(sublime_plugin.TextCommand):
 
         syntax_name = syntax.from_pos(self.view, caret)
         if syntax.is_html(syntax_name):
-            ctx = emmet_sublime.get_tag_context(self.view, caret, syntax.is_xml(syntax_name))
+            ctx = emmet_sublime.get_local_tag_context(self.view, caret, syntax.is_xml(syntax_name))
             if ctx and 'open' in ctx and 'close' in ctx:
                 open_tag = ctx['open']
                 close_tag = ctx['close']
@@ -294,18 +322,19 @@ class EmmetHideTagPreview(sublime_plugin.TextCommand):
 
 class EmmetIncrementNumber(sublime_plugin.TextCommand):
     def run(self, edit, delta=1):
-        inc_dec.update(self.view, edit, delta)
+        lib('inc_dec_number').update(self.view, edit, delta)
         track_action('Increment number', 'delta', delta)
 
 class EmmetDecrementNumber(sublime_plugin.TextCommand):
     def run(self, edit, delta=1):
-        inc_dec.update(self.view, edit, -delta)
+        lib('inc_dec_number').update(self.view, edit, -delta)
         track_action('Increment number', 'delta', delta)
 
 
 class EmmetRemoveTag(sublime_plugin.TextCommand):
     def run(self, edit):
         view = self.view
+        remove_tag = lib('remove_tag').remove_tag
         for sel in view.sel():
             tag = emmet_sublime.get_tag_context(view, sel.begin())
             if tag:
@@ -316,19 +345,19 @@ class EmmetRemoveTag(sublime_plugin.TextCommand):
 
 class EmmetSelectItem(sublime_plugin.TextCommand):
     def run(self, edit, previous=False):
-        select_item.run_action(self.view, previous)
+        lib('select_item').run_action(self.view, previous)
         track_action('Select Item', 'previous' if previous else 'next')
 
 
 class EmmetSplitJoinTag(sublime_plugin.TextCommand):
     def run(self, edit):
-        split_join_tag(self.view, edit)
+        lib('split_join_tag').split_join_tag(self.view, edit)
         track_action('Split/Join Tag')
 
 
 class EmmetUpdateImageSize(sublime_plugin.TextCommand):
     def run(self, edit):
-        update_image_size(self.view, edit)
+        lib('update_image_size').update_image_size(self.view, edit)
         caret = get_caret(self.view)
         track_action('Update Image Size', syntax.from_pos(self.view, caret))
 
@@ -340,9 +369,10 @@ class EmmetWrapWithAbbreviation(sublime_plugin.TextCommand):
         if wrap_abbreviation:
             payload = []
             last_wrap_abbreviation = wrap_abbreviation
+            wrap = lib('wrap_with_abbreviation')
 
             for region, config in self.wrap_entries:
-                snippet = emmet_sublime.expand(wrap_abbreviation, config)
+                snippet = wrap.expand(wrap_abbreviation.strip(), config)
                 payload.append((region, snippet))
 
             multicursor_replace_with_snippet(self.view, edit, payload)
@@ -353,6 +383,7 @@ class EmmetWrapWithAbbreviation(sublime_plugin.TextCommand):
     def input(self, *args, **kwargs):
         # pylint: disable=attribute-defined-outside-init
         view = self.view
+        wrap = lib('wrap_with_abbreviation')
         abbreviation.stop_tracking(view)
         wrap_entries = []
         wrap_size = 0
@@ -383,21 +414,6 @@ class EmmetWrapWithAbbreviation(sublime_plugin.TextCommand):
         return wrap.WrapAbbreviationInputHandler(view, self.wrap_entries, last_wrap_abbreviation, preview)
 
 
-class EmmetWrapWithAbbreviationPreview(sublime_plugin.TextCommand):
-    "Internal command to preview abbreviation in text"
-
-    def run(self, edit: sublime.Edit, items: list):
-        payload = []
-        for begin, end, result in items:
-            payload.append((sublime.Region(begin, end), result))
-
-        multicursor_replace_with_snippet(self.view, edit, payload)
-
-        if payload:
-            r = payload[0][0]
-            self.view.show_at_center(r.begin())
-
-
 class EmmetRenameTag(sublime_plugin.TextCommand):
     def run(self, edit, **kw):
         selection = self.view.sel()
@@ -436,14 +452,21 @@ class EmmetInsertAttribute(sublime_plugin.TextCommand):
 
 		self.view.run_command('insert_snippet', {'contents': '%s%s="$1"' % (prefix, attribute)})
 
+
+class EmmetShowStateRegistrySize(sublime_plugin.ApplicationCommand):
+    "Reports amount of view and buffer state records kept by plugin"
+    def run(self):
+        message = 'Emmet: state registry keeps %d views (max %d) and %d buffers (max %d)' % \
+            (len(view_state.views.items), view_state.views.limit,
+             len(view_state.buffers.items), view_state.buffers.limit)
+        print(message)
+        sublime.status_message(message)
+
+
 class AbbreviationMarkerListener(sublime_plugin.EventListener):
     def __init__(self):
         self.pending_completions_request = False
 
-    @main_view
-    def on_close(self, editor: sublime.View):
-        abbreviation.dispose_editor(editor)
-
     @main_view
     def on_activated(self, editor: sublime.View):
         abbreviation.handle_selection_change(editor, get_caret(editor))
@@ -481,12 +504,10 @@ class AbbreviationMarkerListener(sublime_plugin.EventListener):
             return allow_multicursor_abbr(view)
 
         if key == 'emmet_activation_scope':
-            # For each cursor check if it’s in allowed context
-            for sel in view.sel():
-                if not sel.empty() or not syntax.in_activation_scope(view, sel.end()):
-                    return False
-
-            return True
+            queries = get_query_cache(view)
+            if key not in queries:
+                queries[key] = in_activation_scope(view)
+            return queries[key]
 
         if key == 'has_emmet_abbreviation_mark':
             return bool(abbreviation.get_tracker(view))
@@ -496,9 +517,14 @@ class AbbreviationMarkerListener(sublime_plugin.EventListener):
             return trk.forced if trk else False
 
         if key == 'emmet_capture_abbreviation':
-            if abbreviation.get_tracker(view) or \
-                abbreviation.suggest_abbreviation_tracker(view, get_caret(view)):
+            if abbreviation.get_tracker(view):
+                return True
+
+            # No abbreviation can be extracted for the same contents and selection
+            queries = get_query_cache(view)
+            if key not in queries and abbreviation.suggest_abbreviation_tracker(view, get_caret(view)):
                 return True
+            queries[key] = False
 
         if key == 'emmet_auto_id_class':
             return get_settings('auto_id_class', False)
@@ -507,25 +533,82 @@ class AbbreviationMarkerListener(sublime_plugin.EventListener):
 
     def on_query_completions(self, editor: sublime.View, prefix: str, locations: list):
         pos = locations[0]
-        if self.pending_completions_request:
-            self.pending_completions_request = False
+        expand_abbreviation = self.pending_completions_request
+        self.pending_completions_request = False
+        with_snippets = completions.allow_completions(editor, pos, prefix)
+
+        if hasattr(sublime, 'CompletionList'):
+            # ST4: do not block completions popup, expand abbreviation and
+            # snippets on async thread and add them to completion list later
+            if not expand_abbreviation and not with_snippets:
+                return None
+
+            completion_list = sublime.CompletionList()
+            change_count = editor.change_count()
+            # Async job only updates existing state of view
+            view_state.get_view(editor, True)
+            view_state.get_buffer(editor, True)
+            sublime.set_timeout_async(
+                lambda: self.complete_async(editor, pos, prefix, change_count, completion_list,
+                                            expand_abbreviation, with_snippets), 0)
+            return completion_list
+
+        result = self.abbreviation_completions(editor, pos) if expand_abbreviation else []
+        if with_snippets:
+            result += completions.get_completions(editor, pos, prefix)
+        return result or None
+
+    def complete_async(self, editor: sublime.View, pos: int, prefix: str, change_count: int,
+                       completion_list, expand_abbreviation: bool, with_snippets: bool):
+        "Fills given completion list with abbreviation and snippets expanded at given location"
+        result = []
+        try:
+            if is_same_state(editor, pos, change_count):
+                if expand_abbreviation:
+                    result += self.abbreviation_completions(editor, pos, change_count)
+                if with_snippets:
+                    result += completions.get_completions(editor, pos, prefix)
+        finally:
+            # NB: completion list must be always resolved, even for stale
+            # or failed requests
+            completion_list.set_completions(result)
+
+    def abbreviation_completions(self, editor: sublime.View, pos: int, change_count: int=None) -> list:
+        """
+        Returns completion items for abbreviation at given location. If `change_count`
+        is given, method is invoked on async thread: abbreviation is only extracted
+        and expanded here, tracker is created and marked later on main thread,
+        if editor state is still the same
+        """
+        if change_count is None:
+            self.update_abbreviation_tracker(editor, pos)
+        else:
+            sublime.set_timeout(
+                lambda: is_same_state(editor, pos, change_count) and \
+                    self.update_abbreviation_tracker(editor, pos), 0)
+
+        completion = abbreviation.get_completion(editor, pos)
+        if completion:
+            return [('%s\tEmmet' % completion[0], completion[1])]
+
+        return []
 
-            tracker = None
-            if abbreviation.allow_tracking(editor, pos):
-                tracker = abbreviation.suggest_abbreviation_tracker(editor, pos)
-
-            if tracker:
-                if tracker.valid_candidate:
-                    abbreviation.mark(editor, tracker)
-                    abbreviation.show_preview(editor, tracker)
-                    snippet = emmet_sublime.expand(tracker.abbreviation, tracker.config)
-                    return [('%s\tEmmet' % editor.substr(tracker.region), snippet)]
-                else:
-                    abbreviation.stop_tracking(editor)
+    def update_abbreviation_tracker(self, editor: sublime.View, pos: int):
+        "Starts or stops abbreviation tracking at given location for completions popup"
+        tracker = None
+        if abbreviation.allow_tracking(editor, pos):
+            tracker = abbreviation.suggest_abbreviation_tracker(editor, pos)
+
+        if tracker:
+            if tracker.valid_candidate:
+                abbreviation.mark(editor, tracker)
+                abbreviation.show_preview(editor, tracker)
             else:
-                tracker = abbreviation.get_tracker(editor)
-                if tracker and not tracker.valid_candidate:
-                    abbreviation.stop_tracking(editor)
+                abbreviation.stop_tracking(editor)
+        else:
+            tracker = abbreviation.get_tracker(editor)
+            if tracker and not tracker.valid_candidate:
+                abbreviation.stop_tracking(editor)
 
     def on_text_command(self, view: sublime.View, command_name: str, args: list):
         if command_name == 'auto_complete' and abbreviation.allow_tracking(view, get_caret(view)):
@@ -553,9 +636,27 @@ class AbbreviationMarkerListener(sublime_plugin.EventListener):
                 abbreviation.unmark(editor)
 
 
+class ViewStateListener(sublime_plugin.EventListener):
+    def on_close(self, view: sublime.View):
+        abbreviation.dispose_editor(view)
+        view_state.dispose(view)
+
+
+if hasattr(sublime_plugin, 'TextChangeListener'):
+    class BufferChangeListener(sublime_plugin.TextChangeListener):
+        "Keeps buffer state which is valid before the first changed location (ST4 only)"
+        def on_text_changed(self, changes):
+            view = self.buffer.primary_view()
+            if view and changes:
+                view_state.handle_change(view, changes)
+                select_item = loaded_lib('select_item')
+                if select_item:
+                    select_item.handle_text_change(view, changes)
+
+
 class ToggleCommentListener(sublime_plugin.EventListener):
     def on_text_command(self, view, command_name, args):
-        if command_name == 'toggle_comment' and comment.allow_emmet_comments(view):
+        if command_name == 'toggle_comment' and lib('comment').allow_emmet_comments(view):
             return ('emmet_toggle_comment', None)
         return None
 
@@ -567,17 +668,23 @@ class PreviewTagPair(sublime_plugin.EventListener):
         return None
 
     @tag_pair.allow_preview
-    def on_selection_modified_async(self, view: sublime.View):
-        tag_pair.handle_selection_change(view)
+    def on_selection_modified(self, view: sublime.View):
+        tag_pair.schedule_preview(view)
 
 
 class SelectItemListener(sublime_plugin.EventListener):
-    def on_modified_async(self, view: sublime.View):
-        select_item.reset_model(view)
-
     def on_post_text_command(self, view, command_name, args):
-        if command_name != 'emmet_select_item':
-            select_item.reset_model(view)
+        # No need to reset model if Select Item action wasn’t used yet.
+        # Model is also validated against buffer revision when used, which
+        # covers edits in ST3 where text changes are not reported
+        select_item = loaded_lib('select_item')
+        if select_item:
+            select_item.handle_command(view, command_name)
+
+
+def is_same_state(view: sublime.View, pos: int, change_count: int) -> bool:
+    "Check if given view still has the same contents and caret location"
+    return view.is_valid() and view.change_count() == change_count and get_caret(view) == pos
 
 
 def allow_multicursor_abbr(view: sublime.View):
@@ -592,14 +699,43 @@ def allow_multicursor_abbr(view: sublime.View):
             if tracker.line.contains(s):
                 return True
 
-    # Fast check failed: try to extract abbreviation for any of cursors
-    for s in view.sel():
-        trk = abbreviation.suggest_abbreviation_tracker(view, s.end())
-        if trk:
-            return True
+    # Fast check failed: try to extract abbreviation for any of cursors.
+    # No abbreviation can be extracted for the same contents and selection
+    # if previous attempt failed
+    queries = get_query_cache(view)
+    if 'multicursor_abbr' not in queries:
+        for s in view.sel():
+            trk = abbreviation.suggest_abbreviation_tracker(view, s.end())
+            if trk:
+                return True
+
+        queries['multicursor_abbr'] = False
 
     # Restore previous tracker, if any
     if tracker:
         abbreviation.set_active_tracker(view, tracker)
 
     return False
+
+
+def in_activation_scope(view: sublime.View) -> bool:
+    "Check if all cursors in given view are in allowed context"
+    for sel in view.sel():
+        if not sel.empty() or not syntax.in_activation_scope(view, sel.end()):
+            return False
+
+    return True
+
+
+def get_query_cache(view: sublime.View) -> dict:
+    """
+    Returns storage for answers of context queries which are valid
+    for current contents, syntax and selection of given view
+    """
+    state = view_state.get_view(view, True)
+    key = (view.change_count(), get_settings_revision(), view.settings().get('syntax'),
+           tuple((s.a, s.b) for s in view.sel()))
+    if state.queries_key != key:
+        state.queries_key = key
+        state.queries = {}
+    return state.queries
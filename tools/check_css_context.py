@@ -0,0 +1,283 @@
+import os.path
+import sys
+import types
+
+__doc__ = """
+Checks that CSS context of SCSS and LESS documents, detected with native section
+scopes, is the same as context detected with full scan of document text.
+Runs outside of Sublime Text with minimal fake of its API: section scopes are
+emulated with py-emmet CSS scanner. Requires py-emmet installed either in
+package folder (see README) or in current Python environment.
+
+Usage: python3 tools/check_css_context.py
+"""
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+scss_sample = """
+$primary: #333;
+@import 'base';
+
+// Line comment
+.nav {
+    margin: 0;
+    /* block comment } with brace */
+    &__item {
+        padding: 1px;
+        &:hover { color: $primary; }
+    }
+
+    @media (min-width: 100px) and (max-width: 200px) {
+        display: none;
+        .inner { display: block; }
+    }
+
+    a[title="{"] { content: "}"; }
+    #{$name}-suffix {
+        width: #{$size}px;
+        font: #{$a}/#{$b} serif;
+    }
+    @include mixin($a, $b) {
+        top: 0;
+    }
+    content: ' { } ';
+}
+
+@media print {
+    .page {
+        p { orphans: 3; }
+    }
+}
+
+@mixin mixin($a, $b) {
+    left: $a;
+    right: $b;
+}
+"""
+
+less_sample = """
+@primary: #333;
+@selector: ~".my";
+
+// Line comment
+.nav {
+    margin: 0;
+    /* block comment } with brace */
+    &-item {
+        padding: 1px;
+        &:hover { color: @primary; }
+    }
+
+    @media (min-width: 100px) {
+        display: none;
+        .inner { display: block; }
+    }
+
+    a[title="{"] { content: "}"; }
+    @{selector}-suffix {
+        width: ~"calc(100% - @{size})";
+    }
+    .mixin(@a, @b);
+    content: ' { } ';
+}
+
+@media print {
+    .page {
+        p { orphans: 3; }
+    }
+}
+
+.mixin(@a, @b) {
+    left: @a;
+    right: @b;
+}
+"""
+
+
+class Region:
+    __slots__ = ('a', 'b')
+
+    def __init__(self, a: int, b: int = None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+    def __repr__(self):
+        return 'Region(%d, %d)' % (self.a, self.b)
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+def create_sublime_stub():
+    "Creates minimal fake of `sublime` module required by CSS context detection"
+    stub = types.ModuleType('sublime')
+    stub.Region = Region
+    stub.View = stub.Edit = stub.TextChange = object
+    stub.version = lambda: '4000'
+    stub.platform = lambda: sys.platform
+    stub.windows = lambda: []
+    stub.load_settings = lambda name: Settings()
+    stub.set_timeout = stub.set_timeout_async = lambda fn, delay=0: fn()
+    return stub
+
+
+def load_package():
+    "Loads plugin package as `Emmet` so its relative imports are resolved"
+    sys.modules['sublime'] = create_sublime_stub()
+    package = types.ModuleType('Emmet')
+    package.__path__ = [root]
+    if not os.path.isdir(os.path.join(root, 'emmet')):
+        # py-emmet is installed in Python environment instead of package folder
+        import emmet
+        package.__path__.append(os.path.dirname(os.path.dirname(emmet.__file__)))
+    sys.modules['Emmet'] = package
+
+
+def skip_comments(text: str, start: int, end: int) -> int:
+    "Skips whitespace and comments, which are not part of native selector scope"
+    while start < end:
+        if text[start].isspace():
+            start += 1
+        elif text.startswith('/*', start):
+            close = text.find('*/', start + 2)
+            start = close + 2 if close != -1 else end
+        elif text.startswith('//', start):
+            close = text.find('\n', start)
+            start = close + 1 if close != -1 else end
+        else:
+            break
+    return min(start, end)
+
+
+class StyleView:
+    "Fake view which emulates native section scopes of stylesheet syntax"
+    last_id = 0
+
+    def __init__(self, text: str, syntax_name: str, merge: bool):
+        from Emmet.emmet.css_matcher import scan
+
+        StyleView.last_id += 1
+        self._id = StyleView.last_id
+        self.text = text
+        self._settings = Settings(syntax='Packages/%s/%s.sublime-syntax' % (syntax_name, syntax_name))
+        self.rules = []
+        stack = []
+
+        def callback(token_type, start, end, delimiter):
+            if token_type == 'selector':
+                stack.append((skip_comments(text, start, delimiter), delimiter))
+            elif token_type == 'blockEnd' and stack:
+                selector_start, block_start = stack.pop()
+                self.rules.append((selector_start, block_start, end))
+
+        scan(text, callback)
+        self.sections = self.merge_sections(merge)
+
+    def merge_sections(self, merge: bool) -> list:
+        """
+        Returns list of non-overlapping section regions, like `view.find_by_selector()`
+        does: nested sections are covered by outer property list. With `merge` option,
+        adjacent selector and property list are returned as a single region
+        """
+        regions = [(start, block_start) for start, block_start, _ in self.rules] + \
+            [(block_start, end) for _, block_start, end in self.rules]
+        regions.sort()
+        result = []
+        for start, end in regions:
+            if result and (start < result[-1][1] or (merge and start == result[-1][1])):
+                result[-1][1] = max(result[-1][1], end)
+            else:
+                result.append([start, end])
+        return [Region(start, end) for start, end in result]
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def is_valid(self):
+        return True
+
+    def size(self):
+        return len(self.text)
+
+    def change_count(self):
+        return 0
+
+    def settings(self):
+        return self._settings
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self.text[x.begin():x.end()]
+        return self.text[x:x + 1] if 0 <= x < len(self.text) else '\x00'
+
+    def find_by_selector(self, selector: str):
+        from Emmet.lib import context
+        return list(self.sections) if selector == context.css_section_selector else []
+
+    def match_selector(self, pt: int, selector: str):
+        from Emmet.lib import context
+        if selector == context.css_property_list_selector:
+            return any(block_start <= pt < end for _, block_start, end in self.rules)
+        return False
+
+
+def check(text: str, syntax_name: str) -> int:
+    "Compares CSS contexts in all rules of given document, returns amount of mismatches"
+    from Emmet.lib import context
+
+    errors = 0
+    checks = 0
+    for merge in (True, False):
+        view = StyleView(text, syntax_name, merge)
+        for start, _, end in view.rules:
+            for pos in range(start + 1, end):
+                actual = context.get_css_context(view, pos)
+                expected = context.get_css_context_from_text(text, pos)
+                checks += 1
+                if actual != expected:
+                    errors += 1
+                    print('%s mismatch at %d (merge=%s): %r|%r\n  native: %r\n  scan:   %r' % (
+                        syntax_name, pos, merge, text[max(0, pos - 20):pos], text[pos:pos + 20], actual, expected))
+
+    print('%s: %d locations checked, %d mismatches' % (syntax_name, checks, errors))
+    return errors
+
+
+if __name__ == '__main__':
+    load_package()
+    failed = check(scss_sample, 'SCSS') + check(less_sample, 'LESS')
+    sys.exit(1 if failed else 0)